@@ -17,6 +17,7 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import multiprocessing
 import sys
 from os import remove, rmdir
 from os.path import join
@@ -28,12 +29,14 @@ except NameError:
     # Python 3
     from importlib import reload
 
-from wisent_pkg.grammar import Grammar
+from wisent_pkg.grammar import Grammar, Conflicts
 from wisent_pkg.automaton import Automaton
 
 
 testdir = mkdtemp()
 sys.path = [testdir] + sys.path
+# the generated parsers are rewritten many times in quick succession
+sys.dont_write_bytecode = True
 
 errors = 0
 
@@ -56,12 +59,30 @@ EOF = FakeEOF()
 
 ignore = object()
 
-def check(rules, tests, parser_args={}):
+# every test is run for each of the following code generation options
+variants = [
+    {},
+    {'compact_tables': True},
+    {'direct_code': True},
+    ]
+
+def check(rules, tests, parser_args={}, options={}):
+    for variant in variants:
+        opts = dict(options)
+        opts.update(variant)
+        check_variant(rules, tests, parser_args, opts)
+
+def load_parser(rules, parser_args, options):
     print("-"*70)
+    if options:
+        print("options: "+repr(sorted(options)))
+    options = dict(options)
+    for name in ['iter', 'flat', 'events', 'validate', 'many']:
+        options.setdefault('api_'+name, True)
     g = Grammar(rules)
-    a = Automaton(g)
+    a = Automaton(g, options)
     fd = open(join(testdir,"tmp.py"), "w")
-    a.write_parser(fd)
+    a.write_parser(fd, options)
     fd.close()
     del a, g
 
@@ -70,7 +91,25 @@ def check(rules, tests, parser_args={}):
     p = tmp.Parser(**parser_args)
 
     EOF.set_real_eof(p.EOF)
+    return p
+
+def tree_events(p, tree):
+    events = []
+    todo = [ tree ]
+    while todo:
+        tree = todo.pop()
+        if tree[0] == 'exit':
+            events.append(tree)
+        elif tree[0] in p.terminals:
+            events.append(('token', tree))
+        else:
+            events.append(('enter', tree[0]))
+            todo.append(('exit', tree[0]))
+            todo.extend(tree[:0:-1])
+    return events
 
+def check_variant(rules, tests, parser_args, options):
+    p = load_parser(rules, parser_args, options)
     for input,e_tree,e_err in tests:
         e_err = [ (x[0], frozenset(x[1])) for x in e_err ]
 
@@ -84,6 +123,50 @@ def check(rules, tests, parser_args={}):
             err = [ (x[0], frozenset(x[1])) for x in err ]
 
         success = True
+
+        # the incremental parser must give the same result
+        try:
+            for k,x in enumerate(input):
+                p.feed((x,k))
+            push_tree = p.finish()
+            push_err = []
+        except p.ParseErrors as e:
+            push_tree = e.tree
+            push_err = [ (x[0], frozenset(x[1])) for x in e.errors ]
+            p.reset()
+        if (push_tree, push_err) != (tree, err):
+            print("  incremental parser differs:")
+            print("    got: "+repr((push_tree, push_err)))
+            success = False
+
+        # the recognizer must find the first error
+        try:
+            p.validate((x,k) for k,x in enumerate(input))
+            first_err = []
+        except p.ParseErrors as e:
+            first_err = [ (x[0], frozenset(x[1])) for x in e.errors ]
+        accepted = p.accepts((x,) for x in input)
+        if first_err != err[:1] or accepted != (not err):
+            print("  recognizer differs:")
+            print("    got: "+repr(first_err))
+            success = False
+
+        # the flat tree must describe the same parse tree
+        if not err and not set(['actions', 'nodes']) & set(parser_args):
+            flat = p.parse_flat((x,k) for k,x in enumerate(input))
+            if flat.as_tuple() != tree or \
+                    list(p.leaves(flat.root)) != list(p.leaves(tree)):
+                print("  flat tree differs:")
+                print("    got: "+repr(flat.as_tuple()))
+                success = False
+
+        # the event stream must describe the same parse tree
+        if not err and not set(['actions', 'nodes']) & set(parser_args):
+            events = list(p.parse_events((x,k) for k,x in enumerate(input)))
+            if events != tree_events(p, tree):
+                print("  event stream differs:")
+                print("    got: "+repr(events))
+                success = False
         for e in e_err:
             if e not in err:
                 print("  missed error: "+repr(e))
@@ -191,6 +274,412 @@ tests = [
     ]
 check(rules, tests, {'errcorr_post':3})
 
+# check splicing of transparent repetitions
+rules = [
+    ('list', '_items'),
+    ('_items',),
+    ('_items', '_items', '_item'),
+    ('_item', 1),
+    ('_item', 2, 3),
+    ]
+tests = [
+    ([], ('list',), []),
+    ([1], ('list', (1,0)), []),
+    ([1,2,3,1], ('list', (1,0), (2,1), (3,2), (1,3)), []),
+    ([1]*50, ('list',)+tuple((1,k) for k in range(50)), []),
+    ]
+check(rules, tests, options={'transparent_tokens': set(['_items', '_item'])})
+
+# check the removal of unit rules
+rules = [
+    ('sum', 'sum', '+', 'term'),
+    ('sum', 'term'),
+    ('term', '_factor'),
+    ('_factor', 'atom'),
+    ('_factor', '(', 'sum', ')'),
+    ('atom', 'x'),
+    ]
+tests = [
+    (['x'], ('sum', ('term', ('atom', ('x',0)))), []),
+    (['x','+','(','x',')'],
+     ('sum', ('sum', ('term', ('atom', ('x',0)))), ('+',1),
+      ('term', ('(',2), ('sum', ('term', ('atom', ('x',3)))), (')',4))), []),
+    ]
+options = {'transparent_tokens': set(['_factor'])}
+check(rules, tests, options=options)
+options['unit_rules'] = 'transparent'
+check(rules, tests, options=options)
+tests = [
+    (['x'], ('expr', ('term', ('atom', ('x',0)))), []),
+    (['x','+','(','x',')'],
+     ('expr', ('sum', ('term', ('atom', ('x',0))), ('+',1),
+               ('term', ('(',2), ('term', ('atom', ('x',3))), (')',4)))), []),
+    (['x','+'], ignore, [((EOF,), ['x', '('])]),
+    ]
+options['unit_rules'] = 'skip'
+check([('expr', 'sum')] + rules, tests, options=options)
+
+# check the construction of LALR(1) tables
+tests = [
+    (['x'], ('sum', ('term', ('atom', ('x',0)))), []),
+    (['x','+','(','x',')'],
+     ('sum', ('sum', ('term', ('atom', ('x',0)))), ('+',1),
+      ('term', ('(',2), ('sum', ('term', ('atom', ('x',3)))), (')',4))), []),
+    (['x','+'], ignore, [((EOF,), ['x', '('])]),
+    ]
+options = {'transparent_tokens': set(['_factor']), 'lalr': True}
+check(rules, tests, options=options)
+
+grammars = [
+    (rules, True),
+    ([('S', 'a', 'A', 'd'), ('S', 'b', 'B', 'd'), ('S', 'a', 'B', 'e'),
+      ('S', 'b', 'A', 'e'), ('A', 'c'), ('B', 'c')], False),
+    ]
+for grammar, is_lalr in grammars:
+    print("-"*70)
+    print("LALR(1) grammar: "+repr(is_lalr))
+    g = Grammar(grammar)
+    a = Automaton(g)
+    b = Automaton(g, {'lalr': True})
+    try:
+        same = b.same_tables(a)
+    except Conflicts:
+        same = False
+    if same == is_lalr:
+        print("  success")
+    else:
+        print("  failure")
+        errors += 1
+
+# check semantic actions
+actions = {
+    'expr': lambda s: s,
+    ('sum', 'sum', '+', 'term'): lambda a, op, b: a + b,
+    'sum': lambda t: t,
+    'term': lambda *c: c[1] if len(c) == 3 else c[0],
+    'atom': lambda x: x[1],
+    }
+tests = [
+    (['x'], 0, []),
+    (['x','+','x','+','(','x',')'], 7, []),
+    (['x','+','x','x'], 5, [(('x',3), ['+', EOF])]),
+    ]
+for mode in ['keep', 'skip']:
+    options = {'transparent_tokens': set(['_factor']), 'unit_rules': mode}
+    check([('expr', 'sum')] + rules, tests, {'actions': actions}, options)
+for key in ['_factor', 'product']:
+    try:
+        p = load_parser(rules, {'actions': {key: abs}}, options)
+        print("  failure: invalid action accepted")
+        errors += 1
+    except ValueError:
+        print("  success")
+
+# check the construction of nodes by a factory function
+def node(X, *children):
+    return [X] + list(children)
+tests = [
+    (['x'], ['sum', ['term', ['atom', ('x',0)]]], []),
+    (['x','+','(','x',')'],
+     ['sum', ['sum', ['term', ['atom', ('x',0)]]], ('+',1),
+      ['term', ('(',2), ['sum', ['term', ['atom', ('x',3)]]], (')',4)]], []),
+    (['x','+'],
+     ['sum', ['sum', ['term', ['atom', ('x',0)]]], ('+',1),
+      ['term', ['atom', ('x',)]]], [((EOF,), ['x', '('])]),
+    ]
+options = {'transparent_tokens': set(['_factor'])}
+check(rules, tests, {'nodes': node}, options)
+tests = [
+    (['x','+','x'], ['sum', ['sum', ['term', 0]], ('+',1), ['term', 2]], []),
+    ]
+check(rules, tests, {'nodes': node, 'actions': {'atom': lambda x: x[1]}},
+      options)
+
+# check that lists returned by actions or nodes are not spliced
+rules = [
+    ('list', '_items'),
+    ('_items', '_item'),
+    ('_items', '_items', ',', '_item'),
+    ('_item', 'pair'),
+    ('pair', 'a', 'b'),
+    ]
+tests = [
+    (['a','b',',','a','b'], ('list', [0,1], (',',2), [3,4]), []),
+    ]
+for mode in ['keep', 'transparent', 'skip']:
+    options = {'transparent_tokens': set(['_items', '_item']),
+               'unit_rules': mode}
+    check(rules, tests, {'actions': {'pair': lambda a, b: [a[1], b[1]]}},
+          options)
+tests = [
+    (['a','b',',','a','b'],
+     ['list', ['pair', ('a',0), ('b',1)], (',',2),
+      ['pair', ('a',3), ('b',4)]], []),
+    ]
+for mode in ['keep', 'transparent', 'skip']:
+    options = {'transparent_tokens': set(['_items', '_item']),
+               'unit_rules': mode}
+    check(rules, tests, {'nodes': node}, options)
+
+# check that unit rules for the top symbol and for terminals are kept
+rules = [
+    ('S', '(', 'L', ')'),
+    ('S', 'x'),
+    ('L', 'E'),
+    ('L', 'L', ',', 'E'),
+    ('E', 'S'),
+    ]
+tests = [
+    (['x'], ('S', ('x',0)), []),
+    (['(','x',',','x',')'],
+     ('S', ('(',0), ('L', ('S', ('x',1)), (',',2), ('S', ('x',3))), (')',4)),
+     []),
+    ]
+check(rules, tests, options={'unit_rules': 'skip'})
+p = load_parser(rules, {}, {'unit_rules': 'skip'})
+try:
+    list(p.parse_iter([('x',0)], 'E'))
+    print("  failure: removed symbol accepted")
+    errors += 1
+except ValueError:
+    print("  success")
+
+# check a flat parse tree which consists of a single token
+tree = p.FlatTree([])
+tree.tokens.append(('x',0))
+tree.children.append(-1)
+if tree.root == ('x',0) and tree.as_tuple() == ('x',0):
+    print("  success")
+else:
+    print("  failure: "+repr(tree.root))
+    errors += 1
+
+# check panic-mode error recovery
+rules = [
+    ('block', '_stmts'),
+    ('_stmts',),
+    ('_stmts', '_stmts', 'stmt'),
+    ('stmt', 'x', '=', 'y', ';'),
+    ('stmt', '{', '_stmts', '}'),
+    ]
+tests = [
+    (['x','=','y',';'],
+     ('block', ('stmt', ('x',0), ('=',1), ('y',2), (';',3))), []),
+    (['x','=','=','y',';','x','=','y',';'],
+     ('block', ('stmt', ('x',5), ('=',6), ('y',7), (';',8))),
+     [(('=',2), ['y'])]),
+    (['{','x','=',';','}','x','=','y',';'],
+     ('block', ('stmt', ('{',0), ('}',4)),
+      ('stmt', ('x',5), ('=',6), ('y',7), (';',8))),
+     [((';',3), ['y'])]),
+    (['x','y'], ('block',), [(('y',1), ['='])]),
+    ]
+check(rules, tests, {'panic': True},
+      {'transparent_tokens': set(['_stmts']), 'sync_terminals': [';', '}']})
+# without synchronizing terminals, the end of input is used
+tests = [
+    (['x','=','y',';','x','=','=','y',';'],
+     ('block', ('stmt', ('x',0), ('=',1), ('y',2), (';',3))),
+     [(('=',6), ['y'])]),
+    ]
+check(rules, tests, {'errcorr_trials': 1},
+      {'transparent_tokens': set(['_stmts'])})
+
+# check that parse events are returned while the input is read
+for variant in variants:
+    opts = dict(variant)
+    opts['transparent_tokens'] = set(['_stmts'])
+    p = load_parser(rules, {}, opts)
+    print("input: (x = y ;)^1000")
+    read = []
+    def source():
+        for k in range(1000):
+            for x in ['x', '=', 'y', ';']:
+                read.append(x)
+                yield (x, len(read))
+    lag = 0
+    done = 0
+    for event in p.parse_events(source()):
+        if event == ('exit', 'stmt'):
+            done += 1
+            lag = max(lag, len(read) - 4*done)
+    if done == 1000 and lag <= 1:
+        print("  success")
+    else:
+        print("  failure: %d statements, lag %d"%(done, lag))
+        errors += 1
+
+# check the leaves of a deeply nested parse tree
+rules = [
+    ('E', '(', 'E', ')'),
+    ('E', 'x'),
+    ]
+input = ['(']*5000 + ['x'] + [')']*5000
+for variant in variants:
+    p = load_parser(rules, {}, variant)
+    print("input: (^5000 x )^5000")
+    tree = p.parse((x,k) for k,x in enumerate(input))
+    flat = p.parse_flat((x,k) for k,x in enumerate(input))
+    leaves = [ (x,k) for k,x in enumerate(input) ]
+    if list(p.leaves(tree)) == leaves and \
+            list(p.leaves(flat.root)) == leaves and \
+            list(p.leaves(flat.as_tuple())) == leaves:
+        print("  success")
+    else:
+        print("  failure")
+        errors += 1
+
+# check flat parse trees for invalid input
+rules = [
+    ('list', '_items'),
+    ('_items',),
+    ('_items', '_items', 'item'),
+    ('item', 'a'),
+    ('item', '(', 'item', 'item', ')'),
+    ]
+tests = [
+    ['a','(','a','a'],
+    ['(','a',')','a'],
+    ['a','b','(','a','a',')'],
+    ]
+for variant in variants:
+    opts = dict(variant)
+    opts['transparent_tokens'] = set(['_items'])
+    p = load_parser(rules, {'errcorr_pre': 0}, opts)
+    for input in tests:
+        print("input: "+repr(input))
+        try:
+            p.parse((x,k) for k,x in enumerate(input))
+        except p.ParseErrors as e:
+            expected = (e.tree, e.errors)
+        try:
+            p.parse_flat((x,k) for k,x in enumerate(input))
+        except p.ParseErrors as e:
+            got = (e.tree and e.tree.as_tuple(), e.errors)
+        if got == expected:
+            print("  success")
+        else:
+            print("  failure: "+repr(got))
+            errors += 1
+
+# check parsing several inputs in worker processes
+def parse_result(parse, input):
+    try:
+        return parse(input)
+    except p.ParseErrors as e:
+        return (e.tree, e.errors)
+
+inputs = [ [(x,k) for k,x in enumerate(input)]
+           for input in tests+[['a','a'], []] ]
+for variant in variants:
+    opts = dict(variant)
+    opts['transparent_tokens'] = set(['_items'])
+    p = load_parser(rules, {'errcorr_pre': 0}, opts)
+    expected = [ parse_result(p.parse, input) for input in inputs ]
+    for processes in [1, 2]:
+        for flat in [False, True]:
+            print("processes: %d, flat: %s"%(processes, flat))
+            got = []
+            for res in p.parse_many(inputs, processes, flat):
+                if isinstance(res, p.ParseErrors):
+                    res = (res.tree, res.errors)
+                    if flat and res[0] is not None:
+                        res = (res[0].as_tuple(), res[1])
+                elif flat:
+                    res = res.as_tuple()
+                got.append(res)
+            if got == expected:
+                print("  success")
+            else:
+                print("  failure: "+repr(got))
+                errors += 1
+
+method = multiprocessing.get_start_method()
+multiprocessing.set_start_method('spawn', force=True)
+p = load_parser(rules, {'nodes': node},
+                {'transparent_tokens': set(['_items'])})
+try:
+    p.parse_many(inputs, 2)
+    print("  failure: nodes accepted with the 'spawn' start method")
+    errors += 1
+except ValueError:
+    print("  success")
+multiprocessing.set_start_method(method, force=True)
+
+# check the iteration over subtrees
+def check_iter(rules, symbol, tests, options={}):
+    global errors
+    for variant in variants:
+        opts = dict(options)
+        opts.update(variant)
+        p = load_parser(rules, {}, opts)
+        for input,e_trees,e_err in tests:
+            print("input: "+repr(input))
+            trees = []
+            try:
+                for tree in p.parse_iter(((x,k) for k,x in enumerate(input)),
+                                         symbol):
+                    trees.append(tree)
+                err = []
+            except p.ParseErrors as e:
+                err = [ (x[0], frozenset(x[1])) for x in e.errors ]
+            e_err = [ (x[0], frozenset(x[1])) for x in e_err ]
+            if trees == e_trees and err == e_err:
+                print("  success")
+            else:
+                print("  failure: "+repr((trees, err)))
+                errors += 1
+
+rules = [
+    ('list', '_items'),
+    ('_items',),
+    ('_items', '_items', 'item'),
+    ('item', 'a'),
+    ('item', 'b', 'c'),
+    ('item', '(', 'item', 'item', ')'),
+    ]
+tests = [
+    ([], [], []),
+    (['a','b','c','a'],
+     [('item', ('a',0)), ('item', ('b',1), ('c',2)), ('item', ('a',3))], []),
+    (['(','a','a',')'],
+     [('item', ('a',1)), ('item', ('a',2)),
+      ('item', ('(',0), ('item',), ('item',), (')',3))], []),
+    (['a','b','a'],
+     [('item', ('a',0)), ('item', ('b',1), ('c',)), ('item', ('a',2))],
+     [(('a',2), ['c'])]),
+    ]
+check_iter(rules, 'item', tests,
+           options={'transparent_tokens': set(['_items'])})
+p = load_parser(rules, {}, {'transparent_tokens': set(['_items'])})
+for symbol in ['_items', 'a', 'other']:
+    try:
+        list(p.parse_iter([('a',0)], symbol))
+        print("  failure: invalid symbol %s accepted"%repr(symbol))
+        errors += 1
+    except ValueError:
+        print("  success")
+
+# check that the optional methods are only emitted on request
+methods = {
+    'iter': ['parse_iter'],
+    'flat': ['parse_flat', 'FlatTree'],
+    'events': ['parse_events'],
+    'validate': ['validate', 'accepts'],
+    'many': ['parse_many', 'parse_flat', 'FlatTree'],
+    }
+for name in [None]+sorted(methods):
+    options = dict(('api_'+x, x == name) for x in methods)
+    p = load_parser([('one', 1)], {}, options)
+    print("api: "+repr(name))
+    present = set(x for x in sum(methods.values(), []) if hasattr(p, x))
+    if present == set(methods.get(name, [])) and \
+            p.parse([(1,0)]) == ('one', (1,0)):
+        print("  success")
+    else:
+        print("  failure: "+repr(sorted(present)))
+        errors += 1
+
 import shutil
 shutil.rmtree(testdir)
 
@@ -35,9 +35,30 @@ class Automaton(object):
         LR(1) conflicts in the grammar.  The value should be a
         dictionary with production rule indices as keys and lists of
         overrides as values.
+
+        `params["unit_rules"]` controls the treatment of unit rules,
+        i.e. of production rules with exactly one symbol on the
+        right-hand side.  With the default value "keep", the parser
+        performs all reductions.  With "transparent", reductions by
+        unit rules whose head is one of the transparent symbols in
+        `params["transparent_tokens"]` are removed from the automaton
+        where possible; this does not change the parse trees.  With
+        "skip", all such unit reductions are removed and the
+        corresponding nodes no longer appear in the parse trees.
+
+        If `params["lalr"]` is true, the automaton is constructed as
+        an LALR(1) automaton, using the method of DeRemer and Pennello,
+        1982, instead of the LR(1) algorithm of Pager, 1977.  This is
+        faster, but leads to conflicts for some LR(1) grammars.
         """
         self.g = g
+        self.lalr = params.get("lalr", False)
         self.overrides = params.get("overrides", {})
+        self.unit_rules = params.get("unit_rules", "keep")
+        if self.unit_rules not in ("keep", "transparent", "skip"):
+            msg = "invalid value %s for unit_rules"%repr(self.unit_rules)
+            raise ValueError(msg)
+        self.transparent = params.get("transparent_tokens", frozenset())
 
         self.replace_nonterminals = params.get("replace_nonterminals", False)
         nonterminals = sorted(self.g.nonterminals-set([self.g.start]))
@@ -47,59 +68,68 @@ class Automaton(object):
             self.nt_tab = dict((X,X) for X in nonterminals)
         self.nt_tab[self.g.start] = self.g.start
 
+        self.bypassed_rules = set()
         self.tables_generated = False
         self.checked = False
 
     @staticmethod
-    def _is_compatible(S, T):
+    def _is_compatible(S, T, pairs):
         """Check whether S and T can be merged.
 
+        S and T must have the same core, and `pairs` must list all
+        pairs of distinct items in this core, as returned by
+        `_core_pairs`.
+
         This implements definition 1 (p. 254) from Pager, 1977."""
-        core = list(S.keys())
-        if set(T.keys()) != set(core):
-            return False
-        if len(core) == 1:
-            return True
-        for i in range(0, len(core)-1):
-            I = core[i]
-            for j in range(i+1, len(core)):
-                J = core[j]
-                if ((S[I]&T[J] or S[J]&T[I])
-                    and not S[I]&S[J]
-                    and not T[I]&T[J]):
-                    return False
+        for I,J in pairs:
+            if ((S[I]&T[J] or S[J]&T[I])
+                and not S[I]&S[J]
+                and not T[I]&T[J]):
+                return False
         return True
 
+    @staticmethod
+    def _core_pairs(core):
+        """List all pairs of distinct items in `core`."""
+        core = sorted(core)
+        return [ (I,J) for i,I in enumerate(core) for J in core[i+1:] ]
+
     def _closure(self, U):
+        """Compute the closure of the kernel items `U`.
+
+        `U` maps items to lookahead contexts; as everywhere during the
+        construction of the automaton, the contexts are integers with
+        one bit per terminal, as given by `self.terminal_bits`.
+        """
         rules = self.g.rules
-        first_tokens = self.g.first_tokens
+        suffix_bits = self.suffix_bits
         rule_from_head = self.g.rule_from_head
 
         todo = U.copy()
-        res = {}
-        for prod in todo:
-            res[prod] = todo[prod].copy()
+        res = U.copy()
         while todo:
             prod,ctx = todo.popitem()
             key,l,n = prod
             if n == l:
                 continue
-            rule = rules[key]
-            tail = list(rule[n+1:])
-            new_rules = [ ((k,l,1),res.setdefault((k,l,1), set()))
-                          for k,l in rule_from_head[rule[n]] ]
-            for X in ctx:
-                lookahead = first_tokens(tail+[X])
-                for prod,res_ctx in new_rules:
-                    new = lookahead - res_ctx
-                    if new:
-                        todo_ctx = todo.setdefault(prod, set())
-                        todo_ctx |= new
-                        res_ctx |= new
+            lookahead, nullable = suffix_bits[(key,n+1)]
+            if nullable:
+                lookahead |= ctx
+            for k,l in rule_from_head[rules[key][n]]:
+                prod = (k,l,1)
+                res_ctx = res.setdefault(prod, 0)
+                new = lookahead & ~res_ctx
+                if new:
+                    todo[prod] = todo.get(prod, 0) | new
+                    res[prod] = res_ctx | new
         return res
 
     def _generate_tables(self):
-        """This implements the algorithm of Pager, 1977."""
+        """Construct the states of the automaton.
+
+        Depending on `self.lalr`, this uses `_pager_states` or
+        `_lalr_states`.
+        """
         if self.tables_generated:
             return
 
@@ -117,106 +147,343 @@ class Automaton(object):
             def __repr__(self):
                 return str(self.label)
 
-        rules = self.g.rules
+        # Lookahead contexts are stored as integers, using one bit per
+        # terminal.
+        terminals = sorted(self.g.terminals, key=repr)
+        self.terminal_bits = dict((X,1<<k) for k,X in enumerate(terminals))
+        self.suffix_bits = {}
+        for (key,n),(fi,nullable) in self.g.sutab.items():
+            bits = 0
+            for X in fi:
+                bits |= self.terminal_bits[X]
+            self.suffix_bits[(key,n)] = (bits, nullable)
+
+        decoded = {}
+        def decode(ctx):
+            res = decoded.get(ctx)
+            if res is None:
+                bits = ctx
+                res = []
+                while bits:
+                    low = bits & -bits
+                    res.append(terminals[low.bit_length()-1])
+                    bits ^= low
+                res = decoded[ctx] = frozenset(res)
+            return res
+
+        if self.lalr:
+            tabs = self._lalr_states(StateIndex)
+        else:
+            tabs = self._pager_states(StateIndex)
+        state_tab, reduce_tab, shift_tab, closure_tab = tabs
 
-        state_tab = {}
-        self.initial_state = StateIndex()
-        key, l = self.g.rule_from_head[self.g.start][0]
-        state_tab[self.initial_state] = { (key,l,1): set([self.g.EOF]) }
+        # throw away unused states (might happen when regeneration of
+        # states was needed).
+        todo = set([self.initial_state])
+        used_states = set()
+        while todo:
+            n = todo.pop()
+            used_states.add(n)
+            todo.update(set(shift_tab[n].values())-used_states)
+        for s in set(state_tab.keys())-used_states:
+            del state_tab[s]
+            del reduce_tab[s]
+            del shift_tab[s]
+            del closure_tab[s]
 
-        maybe_compatible = {}
-        for X in self.g.symbols:
-            maybe_compatible[X] = set()
+        keyfn = lambda x: (x == self.halting_state,min(state_tab[x]))
+        states = sorted(used_states, key=keyfn)
+        for k, s in enumerate(states):
+            s.set_label(k)
+        assert repr(self.initial_state) == "0"
 
-        todo = set([self.initial_state])
-        done = set()
+        # convert the contexts back into sets of terminals
+        self.states = states
+        self.state_tab = {}
+        self.reduce_tab = {}
+        self.closure_tab = {}
+        for state in states:
+            U = state_tab[state]
+            self.state_tab[state] = dict((prod, decode(ctx))
+                                         for prod,ctx in U.items())
+            rtab = reduce_tab[state]
+            self.reduce_tab[state] = dict((key, decode(ctx))
+                                          for key,ctx in rtab.items())
+            U = closure_tab[state]
+            self.closure_tab[state] = dict((prod, decode(ctx))
+                                           for prod,ctx in U.items())
+        self.shift_tab = shift_tab
 
-        reduce_tab = {}
-        shift_tab = {}
+        self.tables_generated = True
 
-        while todo:
-            state_no = todo.pop()
-            done.add(state_no)
+    def _pager_states(self, StateIndex):
+        """Construct the LR(1) automaton.
 
-            rtab = reduce_tab.setdefault(state_no,{})
-            stab = shift_tab.setdefault(state_no,{})
+        This implements the algorithm of Pager, 1977.  The return
+        value consists of four dictionaries, which map the states to
+        their kernels, to the lookahead contexts of their reductions,
+        to their transitions, and to their closures.
+        """
+        rules = self.g.rules
 
-            state = self._closure(state_tab[state_no])
+        state_tab = {}
+        self.initial_state = StateIndex()
+        key, l = self.g.rule_from_head[self.g.start][0]
+        state_tab[self.initial_state] = {
+            (key,l,1): self.terminal_bits[self.g.EOF]
+        }
+
+        # Only states with the same core (i.e. the same set of
+        # kernel items) can be merged.  For every core, list the
+        # states and the pairs of items to check for compatibility.
+        cores = {}
+
+        def expand(U):
+            # Find the reductions and the kernels of the neighbours
+            # in the state with kernel U.
+            reduce = {}
             shift = {}
-            for prod,ctx in state.items():
+            for prod,ctx in self._closure(U).items():
                 key,l,n = prod
                 r = rules[key]
                 if n == l:
                     # reduce using rule 'key'
-                    rtab[key] = ctx
+                    reduce[key] = ctx
                 else:
                     # shift symbol r[n]
                     X = r[n]
                     p = (key,l,n+1)
 
                     X_neighbour = shift.setdefault(X, {})
-                    neighbour_ctx = X_neighbour.setdefault(p, set())
-                    neighbour_ctx.update(ctx)
+                    X_neighbour[p] = X_neighbour.get(p, 0) | ctx
+            return reduce, shift
+
+        # When contexts are added to a state which has already been
+        # expanded, only the added contexts are propagated further.
+        # These are collected in `pending`.
+        todo = set([self.initial_state])
+        done = set()
+        pending = {}
+
+        reduce_tab = {}
+        shift_tab = {}
+
+        def merge(S, Tn):
+            # merge S into T
+            T = state_tab[Tn]
+            for prod in S:
+                add = S[prod] & ~T[prod]
+                if add:
+                    T[prod] |= add
+                    if Tn in done:
+                        delta = pending.setdefault(Tn, {})
+                        delta[prod] = delta.get(prod, 0) | add
+
+        while todo or pending:
+            if pending:
+                state_no, delta = pending.popitem()
+                reduce, shift = expand(delta)
+                stab = shift_tab[state_no]
+                for X,S in shift.items():
+                    T = state_tab[stab[X]]
+                    S = dict((prod, S.get(prod, 0)) for prod in T)
+                    if not self._is_compatible(S, T, cores[frozenset(T)][1]):
+                        break
+                    shift[X] = S
+                else:
+                    rtab = reduce_tab[state_no]
+                    for key,ctx in reduce.items():
+                        rtab[key] |= ctx
+                    for X,S in shift.items():
+                        merge(S, stab[X])
+                    continue
+                # The new contexts cannot be merged into one of the
+                # neighbours: regenerate the neighbours of the state.
+                done.remove(state_no)
+                del shift_tab[state_no]
+                del reduce_tab[state_no]
+                todo.add(state_no)
+                continue
+
+            state_no = todo.pop()
+            done.add(state_no)
+
+            rtab, shift = expand(state_tab[state_no])
+            reduce_tab[state_no] = rtab
+            stab = shift_tab.setdefault(state_no,{})
 
             for X,S in shift.items():
-                for Tn in maybe_compatible[X]:
-                    T = state_tab[Tn]
-                    if not self._is_compatible(S, T):
-                        continue
-                    # merge S into T
-                    stab[X] = Tn
-                    changed = False
-                    for prod in S:
-                        add = S[prod] - T[prod]
-                        if add:
-                            T[prod] |= add
-                            changed = True
-                    if changed and Tn in done:
-                        # regenerate the neighbours of T as needed
-                        done.remove(Tn)
-                        del shift_tab[Tn]
-                        del reduce_tab[Tn]
-                        todo.add(Tn)
-                    break
+                core = frozenset(S)
+                if core not in cores:
+                    cores[core] = ([], self._core_pairs(core))
+                candidates, pairs = cores[core]
+                for Tn in candidates:
+                    if self._is_compatible(S, state_tab[Tn], pairs):
+                        stab[X] = Tn
+                        merge(S, Tn)
+                        break
                 else:
                     # create a new state for S
                     next_state = StateIndex()
                     stab[X] = next_state
                     state_tab[next_state] = S
-                    maybe_compatible[X].add(next_state)
+                    candidates.append(next_state)
                     todo.add(next_state)
                     if X == self.g.EOF:
                         self.halting_state = next_state
 
-        # throw away unused states (might happen when regeneration of
-        # states was needed).
-        todo = set([self.initial_state])
-        used_states = set()
-        while todo:
-            n = todo.pop()
-            used_states.add(n)
-            todo.update(set(shift_tab[n].values())-used_states)
-        for s in set(state_tab.keys())-used_states:
-            del state_tab[s]
-            del reduce_tab[s]
-            del shift_tab[s]
+        closure_tab = {}
+        for state,U in state_tab.items():
+            closure_tab[state] = self._closure(U)
+        return state_tab, reduce_tab, shift_tab, closure_tab
 
-        keyfn = lambda x: (x == self.halting_state,min(state_tab[x]))
-        states = sorted(used_states, key=keyfn)
-        for k, s in enumerate(states):
-            s.set_label(k)
-        assert repr(self.initial_state) == "0"
+    def _lalr_states(self, StateIndex):
+        """Construct the LALR(1) automaton.
 
-        self.states = states
-        self.state_tab = state_tab
-        self.reduce_tab = reduce_tab
-        self.shift_tab = shift_tab
+        This builds the LR(0) automaton and then computes the
+        lookahead sets using the relations from DeRemer and Pennello,
+        1982.  The return value is the same as for `_pager_states`.
+        """
+        g = self.g
+        rules = g.rules
+        rule_from_head = g.rule_from_head
+        nonterminals = g.nonterminals
+        terminal_bits = self.terminal_bits
+        suffix_bits = self.suffix_bits
+
+        # the LR(0) automaton
+        key, l = rule_from_head[g.start][0]
+        self.initial_state = StateIndex()
+        kernels = { self.initial_state: [ (key,l,1) ] }
+        index = { frozenset(kernels[self.initial_state]): self.initial_state }
+        shift_tab = {}
+        todo = [ self.initial_state ]
+        while todo:
+            state = todo.pop()
+            closure = list(kernels[state])
+            seen = set(closure)
+            shift = {}
+            for key,l,n in closure:
+                if n == l:
+                    continue
+                X = rules[key][n]
+                shift.setdefault(X, []).append((key,l,n+1))
+                for k,m in rule_from_head[X]:
+                    if (k,m,1) not in seen:
+                        seen.add((k,m,1))
+                        closure.append((k,m,1))
+            stab = shift_tab[state] = {}
+            for X,kernel in shift.items():
+                core = frozenset(kernel)
+                if core not in index:
+                    next_state = StateIndex()
+                    index[core] = next_state
+                    kernels[next_state] = kernel
+                    todo.append(next_state)
+                    if X == g.EOF:
+                        self.halting_state = next_state
+                stab[X] = index[core]
+
+        # For every nonterminal transition (p, A), compute the
+        # terminals which can be read after A (`Read`) and the
+        # terminals which can follow A in p (`Follow`).
+        trans = [ (p,A) for p in kernels for A in shift_tab[p]
+                  if A in nonterminals ]
+        Read = {}
+        reads = {}
+        for p,A in trans:
+            r = shift_tab[p][A]
+            bits = 0
+            rel = []
+            for X in shift_tab[r]:
+                if X not in nonterminals:
+                    bits |= terminal_bits[X]
+                elif X in g.nullable:
+                    rel.append((r,X))
+            Read[(p,A)] = bits
+            reads[(p,A)] = rel
+        self._digraph(trans, reads, Read)
+
+        includes = dict((x, []) for x in trans)
+        for p,B in trans:
+            for key,l in rule_from_head[B]:
+                rule = rules[key]
+                q = p
+                for n in range(1, l):
+                    X = rule[n]
+                    if X in nonterminals and suffix_bits[(key,n+1)][1]:
+                        includes[(q,X)].append((p,B))
+                    q = shift_tab[q][X]
+        Follow = Read.copy()
+        self._digraph(trans, includes, Follow)
+
+        # The items A -> .w in p have the context Follow(p, A).  The
+        # items obtained by shifting parts of w inherit this context.
+        ctx = dict((state, {}) for state in kernels)
+        def walk(p, key, l, bits):
+            for n in range(1, l+1):
+                items = ctx[p]
+                items[(key,l,n)] = items.get((key,l,n), 0) | bits
+                if n < l:
+                    p = shift_tab[p][rules[key][n]]
+        key, l, _ = kernels[self.initial_state][0]
+        walk(self.initial_state, key, l, terminal_bits[g.EOF])
+        for p,A in trans:
+            for key,l in rule_from_head[A]:
+                walk(p, key, l, Follow[(p,A)])
 
-        self.closure_tab = {}
-        for state in states:
-            self.closure_tab[state] = self._closure(self.state_tab[state])
+        state_tab = {}
+        reduce_tab = {}
+        for state,kernel in kernels.items():
+            items = ctx[state]
+            state_tab[state] = dict((prod, items[prod]) for prod in kernel)
+            reduce_tab[state] = dict((key, bits)
+                                     for (key,l,n),bits in items.items()
+                                     if n == l)
+        return state_tab, reduce_tab, shift_tab, ctx
 
-        self.tables_generated = True
+    @staticmethod
+    def _digraph(nodes, rel, F):
+        """Propagate values along the edges of a directed graph.
+
+        `rel` maps every node to the list of its successors, and `F`
+        maps nodes to integers.  On return, `F[x]` is the bitwise or
+        of the original values of all nodes reachable from x.  This
+        implements the algorithm "Digraph" from DeRemer and Pennello,
+        1982, without recursion.
+        """
+        infinity = len(nodes)+1
+        N = dict.fromkeys(nodes, 0)
+        stack = []
+        for x in nodes:
+            if N[x]:
+                continue
+            stack.append(x)
+            N[x] = len(stack)
+            work = [ (x, iter(rel[x]), len(stack)) ]
+            while work:
+                x, it, d = work[-1]
+                for y in it:
+                    if not N[y]:
+                        stack.append(y)
+                        N[y] = len(stack)
+                        work.append((y, iter(rel[y]), len(stack)))
+                        break
+                    N[x] = min(N[x], N[y])
+                    F[x] |= F[y]
+                else:
+                    work.pop()
+                    if N[x] == d:
+                        while True:
+                            y = stack.pop()
+                            N[y] = infinity
+                            F[y] = F[x]
+                            if y == x:
+                                break
+                    if work:
+                        z = work[-1][0]
+                        N[z] = min(N[z], N[x])
+                        F[z] |= F[x]
 
     def _get_actions(self, state, X):
         """Get the neighbours of a node in the automaton's state graph.
@@ -330,20 +597,137 @@ class Automaton(object):
                     else:
                         gtab[(int(state),nt_tab[X])] = action[1]
                 elif state != self.halting_state:
-                    rule = self.g.rules[action[1]]
-                    if X in nt_tab:
-                        X = nt_tab[X]
-                    rtab[(int(state),X)] = (nt_tab[rule[0]],len(rule)-1)
+                    rtab[(int(state),X)] = action[1]
 
         if conflicts:
             raise conflicts
 
+        # States which reduce by the same rule for every valid
+        # lookahead token can reduce without looking at the input.
+        rules_used = {}
+        for (state,X),key in rtab.items():
+            rules_used.setdefault(state, set()).add(key)
+        shifting = set(state for state,X in stab)
+        default_tab = {}
+        for state,keys in rules_used.items():
+            if len(keys) == 1 and state not in shifting:
+                default_tab[state] = keys.pop()
+
+        if self.unit_rules != "keep":
+            self._bypass_unit_rules(stab, gtab, default_tab)
+
         self.rtab = rtab
         self.gtab = gtab
         self.stab = stab
+        self.default_tab = default_tab
 
         self.checked = True
 
+    def same_tables(self, other):
+        """Check whether two automata have the same parse tables.
+
+        `other` must be an automaton for the same grammar.  Both
+        automata are checked first, which raises a Conflicts exception
+        if one of them has conflicts.  The states are matched along
+        the transitions from the initial states, so that the result
+        does not depend on the numbering of states.
+        """
+        self.check()
+        other.check()
+        if len(self.states) != len(other.states):
+            return False
+
+        def rows(a):
+            res = dict((int(state), {}) for state in a.states)
+            for (state,X),key in a.rtab.items():
+                res[state][('R',X)] = key
+            for (state,X),next_state in a.stab.items():
+                res[state][('S',X)] = int(next_state)
+            for (state,X),next_state in a.gtab.items():
+                res[state][('G',X)] = int(next_state)
+            for state,key in a.default_tab.items():
+                res[state][('D',)] = key
+            return res
+        rows1 = rows(self)
+        rows2 = rows(other)
+
+        match = { 0: 0 }
+        todo = [ 0 ]
+        while todo:
+            state = todo.pop()
+            row1 = rows1[state]
+            row2 = rows2[match[state]]
+            if row1.keys() != row2.keys():
+                return False
+            for action,x in row1.items():
+                y = row2[action]
+                if action[0] in ('R', 'D'):
+                    if x != y:
+                        return False
+                elif x not in match:
+                    match[x] = y
+                    todo.append(x)
+                elif match[x] != y:
+                    return False
+        return len(set(match.values())) == len(match)
+
+    def _bypass_unit_rules(self, stab, gtab, default_tab):
+        """Remove reductions by unit rules from the tables.
+
+        The keys of all unit rules A -> B which can be removed are
+        stored in `self.bypassed_rules`.  Instead of reducing by such a
+        rule, the generated parser keeps the node for B on the stack
+        and only moves to the target of the transition for A, so that
+        the node for A is never constructed.  Visible symbols are
+        never replaced by transparent ones, since this would change
+        the parse trees beyond removing the node for A.  Rules where
+        B is a terminal or A is the top symbol of the grammar are
+        kept, so that every parse tree has a node at its root and
+        tokens only appear as children of nodes for their rules.
+
+        Additionally, if the transition for B leads into a state where
+        the only possible action is such a reduction, the transition is
+        redirected to the target of the transition for A, and the
+        parser never enters the intermediate state.  Chains of unit
+        rules are followed to the end.
+        """
+        rules = self.g.rules
+        nt_tab = self.nt_tab
+        key, l = self.g.rule_from_head[self.g.start][0]
+        top = rules[key][1]
+        bypassed = set()
+        for key,rule in rules.items():
+            if len(rule) != 2 or rule[0] in (self.g.start, top):
+                continue
+            if rule[1] in self.g.terminals:
+                continue
+            A, B = rule
+            if A not in self.transparent:
+                if self.unit_rules == "transparent":
+                    continue
+                if B in self.transparent:
+                    # the children of B would be spliced into the parent
+                    continue
+            bypassed.add(key)
+
+        unit_head = {}
+        for state,key in default_tab.items():
+            if key in bypassed:
+                unit_head[state] = rules[key][0]
+
+        def target(state, next_state, seen):
+            A = unit_head.get(int(next_state))
+            if A is None or A in seen or (state,nt_tab[A]) not in gtab:
+                return next_state
+            seen.add(A)
+            return target(state, gtab[(state,nt_tab[A])], seen)
+
+        for tab in (stab, gtab):
+            for (state,X),next_state in list(tab.items()):
+                tab[(state,X)] = target(state, next_state, set())
+
+        self.bypassed_rules = bypassed
+
     def write_transition_table(self, fd, prefix="# "):
         """Emit a textual description of the automaton's transition table.
 
@@ -441,6 +825,11 @@ class Automaton(object):
         A complete, stand-alone Python source file implementing the
         parser is written to the file-like object `fd`, each line of
         the output is prefixed with the string `prefix`.
+
+        The methods `parse_iter`, `parse_flat`, `parse_events`,
+        `validate` and `accepts`, and `parse_many` are only emitted if
+        `options` sets "api_iter", "api_flat", "api_events",
+        "api_validate" or "api_many", respectively, to True.
         """
         self.check()
 
@@ -449,6 +838,17 @@ class Automaton(object):
         from time import strftime
         params.setdefault('date', strftime("%Y-%m-%d %H:%M:%S"))
         params['version'] = VERSION
+        params['unit_relabel'] = bool(self.bypassed_rules)
+        params['replace_nonterminals'] = self.replace_nonterminals
+        if params.get("parser_debugprint", False):
+            # the per-state functions print no debug messages
+            params["direct_code"] = False
+        if params.get("direct_code", False):
+            # the tables are still used for error recovery
+            params["compact_tables"] = True
+        if params.get("api_many", False):
+            # the workers can return flat trees
+            params["api_flat"] = True
 
         write_block(fd, 0, """# LR(1) parser, autogenerated on %(date)s
 # generator: wisent %(version)s, http://seehuhn.de/pages/wisent
@@ -464,10 +864,21 @@ class Automaton(object):
 
         fd.write('\n')
         fd.write('from itertools import chain\n')
+        fd.write('from time import time\n')
 
         write_block(fd, 0, getsource(Unique))
         fd.write('\n')
 
+        nt_tab = self.nt_tab
+        transparent = params.get("transparent_tokens", set())
+        transparent &= self.g.nonterminals
+        params["transparent_tokens"] = transparent
+        if transparent:
+            write_block(fd, 0, getsource(template._TransparentNode))
+            fd.write('\n')
+        if params.get("direct_code", False):
+            default_fn, action_fn = self._write_direct_code(fd, transparent)
+
         fd.write('class Parser(object):\n\n')
 
         fd.write('    """LR(1) parser class.\n')
@@ -497,16 +908,17 @@ class Automaton(object):
             fd.write('\n')
             self.write_parser_states(fd)
 
-        write_block(fd, 4, getsource(template.Parser.ParseErrors))
+        write_block(fd, 4, getsource(template.Parser.ParseErrors), params)
+        write_block(fd, 4, getsource(template.Parser._Input))
+        if params.get("api_flat", False):
+            write_block(fd, 4, getsource(template.Parser.FlatTree))
 
         fd.write('\n')
         tt = list(map(repr, sorted(self.g.terminals-set([self.g.EOF]))))
         for l in split_it(tt, padding="    ", start1="terminals = [ ",
                           end2=" ]"):
             fd.write(l+'\n')
-        nt_tab = self.nt_tab
-        transparent = params.get("transparent_tokens", set())
-        transparent &= self.g.nonterminals
+        fd.write("    _terminals = frozenset(terminals)\n")
         if self.replace_nonterminals:
             symbols = self.g.nonterminals-set([self.g.start])-transparent
             nonterminals = sorted(symbols)
@@ -517,7 +929,8 @@ class Automaton(object):
         if transparent:
             tt = [ repr(nt_tab[X]) for X in sorted(transparent) ]
             for l in split_it(tt, padding="    ",
-                              start1="_transparent = [ ", end2=" ]"):
+                              start1="_transparent = frozenset([ ",
+                              end2=" ])"):
                 fd.write(l+'\n')
 
         fd.write("    EOF = Unique('EOF')\n")
@@ -526,36 +939,518 @@ class Automaton(object):
         # halting state
         fd.write('\n')
         fd.write("    _halting_state = %s\n"%self.halting_state)
+        tt = list(map(repr, sorted(params.get("sync_terminals", ()))))
+        if tt:
+            for l in split_it(tt, padding="    ",
+                              start1="_sync = frozenset([ ", end2=" ])"):
+                fd.write(l+'\n')
+        else:
+            fd.write("    _sync = frozenset()\n")
+
+        if params.get("compact_tables", False):
+            self._write_compact_tables(fd)
+        else:
+            self._write_dict_tables(fd)
+        if transparent:
+            self._write_splice_table(fd, transparent)
+        self._write_expected_table(fd)
+        if params.get("api_events", False):
+            self._write_parents_table(fd)
+        tt = [ repr(self.g.rules[k]) for k in self._production_keys() ]
+        for l in split_it(tt, padding="    ", start1="_productions = [ ",
+                          end2=" ]"):
+            fd.write(l+'\n')
+        if params.get("direct_code", False):
+            for l in split_it(default_fn, padding="    ",
+                              start1="_direct_default = [ ", end2=" ]"):
+                fd.write(l+'\n')
+            for l in split_it(action_fn, padding="    ",
+                              start1="_direct_action = [ ", end2=" ]"):
+                fd.write(l+'\n')
+
+        write_block(fd, 4, getsource(template.Parser.__init__), params)
+        write_block(fd, 4, getsource(template.Parser._action_hooks), params)
+        write_block(fd, 4, getsource(template.Parser.leaves), params)
+        write_block(fd, 4, getsource(template.Parser._parse), params)
+        write_block(fd, 4, getsource(template.Parser._try_parse), params)
+        write_block(fd, 4, getsource(template.Parser._backtrack), params)
+        write_block(fd, 4, getsource(template.Parser._recover), params)
+        write_block(fd, 4, getsource(template.Parser._panic), params)
+        write_block(fd, 4, getsource(template.Parser.parse), params)
+        if params.get("api_iter", False):
+            write_block(fd, 4, getsource(template.Parser.parse_iter), params)
+        if params.get("api_flat", False):
+            write_block(fd, 4, getsource(template.Parser.parse_flat), params)
+        if params.get("api_events", False):
+            write_block(fd, 4, getsource(template.Parser.parse_events),
+                        params)
+        if params.get("api_validate", False):
+            write_block(fd, 4, getsource(template.Parser.validate), params)
+            write_block(fd, 4, getsource(template.Parser.accepts), params)
+        if params.get("api_many", False):
+            write_block(fd, 4, getsource(template.Parser.parse_many), params)
+            write_block(fd, 4, getsource(template.Parser._init_worker),
+                        params)
+            write_block(fd, 4, getsource(template.Parser._parse_item),
+                        params)
+        write_block(fd, 4, getsource(template.Parser.reset), params)
+        write_block(fd, 4, getsource(template.Parser._feed), params)
+        write_block(fd, 4, getsource(template.Parser.feed), params)
+        write_block(fd, 4, getsource(template.Parser.finish), params)
+
+    def _production_keys(self):
+        """Return the keys of all production rules used by the parser.
+
+        The production rules are listed in the same order as in the
+        docstring of the generated parser; the start rule is omitted.
+        """
+        rules = self.g.rules
+        return sorted(k for k in rules if rules[k][0] != self.g.start)
+
+    def _rule_length(self, key):
+        """Return the rule length used in the generated `_rules` table.
+
+        This is the number of symbols on the right-hand side of the
+        rule, or -1 for unit rules removed by `_bypass_unit_rules`.
+        """
+        if key in self.bypassed_rules:
+            return -1
+        return len(self.g.rules[key])-1
+
+    def _action_table(self):
+        """Merge the shift and reduce tables into one action table.
+
+        The keys of the returned dictionary are pairs, consisting of a
+        state and a terminal symbol.  Positive values indicate shift
+        actions and give the new state of the automaton.  A negative
+        value -k-1 indicates a reduce action, using the `k`th rule
+        returned by `_production_keys`.  Since no transition leads back
+        into the initial state, the value 0 can be used to indicate
+        parse errors.
+        """
+        index = dict((key,k) for k,key in enumerate(self._production_keys()))
+        atab = {}
+        for key,next_state in self.stab.items():
+            atab[key] = int(next_state)
+        for key,rule in self.rtab.items():
+            if key[0] in self.default_tab:
+                continue
+            atab[key] = -index[rule]-1
+        return atab
+
+    def _relabeled_symbols(self):
+        """Return the symbols which can be replaced by other symbols.
+
+        If the reduction by a unit rule A -> B has been removed, the
+        node for B stands in for the node for A, so positions of A in
+        other rules might hold nodes for B.
+        """
+        return set(self.g.rules[key][0] for key in self.bypassed_rules)
+
+    def _write_splice_table(self, fd, transparent):
+        """Emit the table which describes the transparent children.
+
+        The emitted list is indexed by production rule.  The entry is
+        None if no symbol on the right-hand side of the rule is
+        transparent.  Otherwise it is a tuple with one entry per
+        symbol: 0 for visible symbols, 1 for transparent symbols and 2
+        for transparent symbols which might be replaced by a visible
+        one (see `_relabeled_symbols`).
+        """
+        relabeled = self._relabeled_symbols()
+        rules = self.g.rules
+        tt = []
+        for key in self._production_keys():
+            rhs = rules[key][1:]
+            if not any(Y in transparent for Y in rhs):
+                tt.append("None")
+                continue
+            splice = []
+            for Y in rhs:
+                if Y not in transparent:
+                    splice.append(0)
+                elif Y in relabeled:
+                    splice.append(2)
+                else:
+                    splice.append(1)
+            tt.append(repr(tuple(splice)))
+        for l in split_it(tt, padding="    ", start1="_splice = [ ",
+                          end2=" ]"):
+            fd.write(l+'\n')
+
+    def _write_expected_table(self, fd):
+        """Emit the table of expected terminals, used in error messages.
 
-        # reduce actions
-        rtab = self.rtab
-        r_items = [ "%s: %s"%(repr(key),repr(rtab[key]))
-                    for key in sorted(self.rtab, key=lambda x: (type(x).__name__, str(x))) ]
-        fd.write("    _reduce = {\n")
-        for l in split_it(r_items, padding="        "):
+        The emitted list is indexed by state.  Each entry is the tuple
+        of terminal symbols for which the parse tables have an entry,
+        in the order of their codes (see `_symbol_codes`).  States with
+        a default reduction never detect errors, the entries for these
+        states are None.
+        """
+        _, t_code, _, _ = self._symbol_codes()
+        n_states = int(self.halting_state)+1
+        expected = [ set() for state in range(n_states) ]
+        for tab in (self.stab, self.rtab):
+            for state,X in tab:
+                expected[state].add(X)
+        fd.write("    _expected = [\n")
+        for state,tt in enumerate(expected):
+            if state in self.default_tab:
+                fd.write("        None,\n")
+                continue
+            tt = [ repr(X) for X in sorted(tt, key=lambda X: t_code[X]) ]
+            if len(tt) == 1:
+                tt[0] += ","
+            for l in split_it(tt, padding="        ", start1="( ",
+                              end2=" ),"):
+                fd.write(l+'\n')
+        fd.write("    ]\n")
+
+    def _write_parents_table(self, fd):
+        """Emit the table of kernel items, used to find parent nodes.
+
+        The emitted list is indexed by state.  Each entry is a tuple
+        of pairs (k, n), one for every kernel item of the state, where
+        `k` is the index of the production rule and `n` is the number
+        of symbols before the one just shifted.  For the start rule,
+        `k` is -1.  Thus the node on top of the stack will become a
+        child of a node for rule `k`, which starts `n` stack entries
+        further down.
+        """
+        index = dict((key,k) for k,key in enumerate(self._production_keys()))
+        tt = []
+        for state in self.states:
+            items = set()
+            for key,l,n in self.state_tab[state]:
+                if n > 1:
+                    items.add((index.get(key, -1), n-2))
+            tt.append(repr(tuple(sorted(items))))
+        for l in split_it(tt, padding="    ", start1="_parents = [ ",
+                          end2=" ]"):
+            fd.write(l+'\n')
+
+    def _write_default_table(self, fd):
+        """Emit the table of default reductions.
+
+        The emitted list is indexed by state.  For states which have a
+        default reduction, the entry encodes the reduce action in the
+        same way as the entries of the action table, all other entries
+        are 0.
+        """
+        index = dict((key,k) for k,key in enumerate(self._production_keys()))
+        n_states = int(self.halting_state)+1
+        default = [ 0 ] * n_states
+        for state,rule in self.default_tab.items():
+            default[state] = -index[rule]-1
+        for l in split_it(default, padding="    ", start1="_default = [ ",
+                          end2=" ]"):
+            fd.write(l+'\n')
+
+    def _write_dict_tables(self, fd):
+        """Emit the parse tables as dictionaries.
+
+        The keys of the emitted dictionaries are pairs, consisting of
+        a state and a grammar symbol.
+        """
+        nt_tab = self.nt_tab
+        rules = self.g.rules
+        tt = [ repr((nt_tab[rules[k][0]],self._rule_length(k)))
+               for k in self._production_keys() ]
+        for l in split_it(tt, padding="    ", start1="_rules = [ ",
+                          end2=" ]"):
+            fd.write(l+'\n')
+
+        keyfn = lambda x: (x[0], type(x[1]).__name__, str(x[1]))
+
+        self._write_default_table(fd)
+
+        # shift and reduce actions
+        atab = self._action_table()
+        a_items = [ "%s: %d"%(repr(key),atab[key])
+                    for key in sorted(atab, key=keyfn) ]
+        fd.write("    _action = {\n")
+        for l in split_it(a_items, padding="        "):
             fd.write(l+'\n')
         fd.write("    }\n")
 
         # goto table
         gtab = self.gtab
         g_items = [ "%s: %s"%(repr(key),repr(gtab[key]))
-                    for key in sorted(self.gtab, key=lambda x: (type(x).__name__, str(x))) ]
+                    for key in sorted(gtab, key=keyfn) ]
         fd.write("    _goto = {\n")
         for l in split_it(g_items, padding="        "):
             fd.write(l+'\n')
         fd.write("    }\n")
 
-        # shift table
-        stab = self.stab
-        s_items = [ "%s: %s"%(repr(key),repr(stab[key]))
-                    for key in sorted(self.stab, key=lambda x: (type(x).__name__, str(x))) ]
-        fd.write("    _shift = {\n")
-        for l in split_it(s_items, padding="        "):
+    def _symbol_codes(self):
+        """Map the grammar symbols to small integers.
+
+        Returns a 4-tuple (terminals, t_code, nonterminals, nt_code).
+        'terminals' is the list of terminal symbols, ordered by code,
+        with EOF last; 't_code' maps terminals to their codes.
+        'nonterminals' is the sorted list of nonterminals (without the
+        start symbol) and 'nt_code' maps the entries of `self.nt_tab`
+        to their codes.
+        """
+        terminals = sorted(self.g.terminals-set([self.g.EOF])) + [self.g.EOF]
+        t_code = dict((X,k) for k,X in enumerate(terminals))
+        nt_tab = self.nt_tab
+        nonterminals = sorted(self.g.nonterminals-set([self.g.start]))
+        nt_code = dict((nt_tab[X],k) for k,X in enumerate(nonterminals))
+        return terminals, t_code, nonterminals, nt_code
+
+    def _write_compact_tables(self, fd):
+        """Emit the parse tables as lists of rows.
+
+        Terminal and nonterminal symbols are mapped to small
+        integers, and the tables are indexed by state and symbol code.
+        Missing entries are represented by 0.
+        """
+        terminals, t_code, nonterminals, nt_code = self._symbol_codes()
+        nt_tab = self.nt_tab
+        n_states = int(self.halting_state)+1
+
+        tt = [ "%s: %d"%(repr(X),k) for k,X in enumerate(terminals) ]
+        for l in split_it(tt, padding="    ", start1="token_codes = { ",
+                          end2=" }"):
             fd.write(l+'\n')
-        fd.write("    }\n")
 
-        write_block(fd, 4, getsource(template.Parser.__init__), params)
-        write_block(fd, 4, getsource(template.Parser.leaves), params)
-        write_block(fd, 4, getsource(template.Parser._parse), params)
-        write_block(fd, 4, getsource(template.Parser._try_parse), params)
-        write_block(fd, 4, getsource(template.Parser.parse), params)
+        rules = self.g.rules
+        tt = []
+        for k in self._production_keys():
+            X = nt_tab[rules[k][0]]
+            tt.append(repr((X,self._rule_length(k),nt_code[X])))
+        for l in split_it(tt, padding="    ", start1="_rules = [ ",
+                          end2=" ]"):
+            fd.write(l+'\n')
+
+        self._write_default_table(fd)
+
+        def write_table(name, tab, n_cols, code, skip=()):
+            rows = [ [0]*n_cols for state in range(n_states) ]
+            for (state,X),value in tab.items():
+                rows[state][code[X]] = int(value)
+            fd.write("    %s = [\n"%name)
+            for state,row in enumerate(rows):
+                if state in skip:
+                    # never used, because of the default reduction
+                    fd.write("        None,\n")
+                    continue
+                for l in split_it(row, padding="        ", start1="[ ",
+                                  end2=" ],"):
+                    fd.write(l+'\n')
+            fd.write("    ]\n")
+        default_states = set(int(state) for state in self.default_tab)
+        write_table("_action", self._action_table(), len(terminals), t_code,
+                    default_states)
+        write_table("_goto", self.gtab, len(nonterminals), nt_code)
+
+    def _write_direct_code(self, fd, transparent):
+        """Emit one Python function for every state of the automaton.
+
+        For states with a default reduction, a function `_reduce<state>`
+        is emitted which takes the parser stack and the hooks argument
+        of `_parse` as its arguments.  For all other states, a function
+        `_state<state>` is emitted which takes the stack, the code of
+        the lookahead token, the lookahead token itself and the hooks.
+        Both functions return the new state
+        of the automaton; shift actions are indicated by negative
+        return values, parse errors by 0.  The code for reductions is
+        specialised to the production rule and to the state, so that
+        the generated parser needs neither the `_rules` table nor any
+        loops to construct the parse tree.
+
+        The class attributes `_direct_default` and `_direct_action`,
+        indexed by state, list these functions.  They are written by
+        `write_parser`, since the functions are defined outside of the
+        class.  `transparent` is the set of transparent nonterminals.
+        """
+        rules = self.g.rules
+        nt_tab = self.nt_tab
+        _, t_code, _, nt_code = self._symbol_codes()
+        index = dict((key,k) for k,key in enumerate(self._production_keys()))
+        n_states = int(self.halting_state)+1
+
+        relabeled = self._relabeled_symbols()
+
+        goto = {}
+        for (state,X),next_state in self.gtab.items():
+            goto.setdefault(X, {})[state] = int(next_state)
+        for X in sorted(goto, key=lambda X: nt_code[X]):
+            tt = [ "%d: %d"%(state,goto[X][state])
+                   for state in sorted(goto[X]) ]
+            for l in split_it(tt, start1="_goto%d = { "%nt_code[X],
+                              end2=" }"):
+                fd.write(l+'\n')
+
+        def goto_code(X, state):
+            if state is not None:
+                return "%d"%goto[X][state]
+            targets = set(goto[X].values())
+            if len(targets) == 1:
+                return "%d"%targets.pop()
+            return "_goto%d[s]"%nt_code[X]
+
+        def reduce_code(key, state):
+            rule = rules[key]
+            X = nt_tab[rule[0]]
+            n = self._rule_length(key)
+            if n < 0:
+                return [ "return _goto%d[stack[-1][0]]"%nt_code[X] ]
+            if rule[0] in transparent:
+                # hooks for transparent symbols get the node itself
+                lookup = [ ]
+                hook = [ "if hooks:",
+                         "    hook = hooks.get(%d)"%index[key],
+                         "    if hook is not None:",
+                         "        tree = hook(%s, tree)"%repr(X) ]
+            else:
+                # hooks replace the construction of the node
+                lookup = [ "if hooks:",
+                           "    hook = hooks.get(%d)"%index[key],
+                           "else:",
+                           "    hook = None" ]
+                hook = [ ]
+            if n == 0:
+                if rule[0] in transparent:
+                    code = [ "tree = _TransparentNode((%s,))"%repr(X) ]
+                else:
+                    code = [ "if hook is None:",
+                             "    tree = (%s,)"%repr(X),
+                             "else:",
+                             "    tree = hook(%s, [])"%repr(X) ]
+                return lookup + code + hook + [
+                    "stack.append((%d, tree))"%state,
+                    "return "+goto_code(X, state) ]
+
+            code = lookup + [ "s = stack[-%d][0]"%n ]
+            items = [ ]
+            for i,Y in enumerate(rule[1:]):
+                entry = "stack[-%d][1]"%(n-i)
+                if Y not in transparent:
+                    items.append(("append", entry))
+                elif Y in relabeled:
+                    items.append(("check", entry))
+                else:
+                    items.append(("extend", entry))
+
+            is_tuple = False
+            if rule[0] in transparent and rule[1] == rule[0]:
+                # extend the list for a left-recursive repetition in place
+                code.append("tree = stack[-%d][1]"%n)
+                if rule[0] in relabeled:
+                    code.extend([
+                        "if type(tree) is not _TransparentNode:",
+                        "    tree = _TransparentNode((%s, tree))"%repr(X),
+                        "elif tree[0] != %s:"%repr(X),
+                        "    tree = _TransparentNode([ %s ] + tree[1:])"
+                        %repr(X) ])
+                items = items[1:]
+            elif rule[0] not in transparent and \
+                    all(how == "append" for how,entry in items):
+                children = ", ".join(entry for how,entry in items)
+                code.extend([
+                    "if hook is None:",
+                    "    tree = (%s, %s)"%(repr(X), children),
+                    "else:",
+                    "    tree = hook(%s, [ %s ])"%(repr(X), children) ])
+                items = [ ]
+                is_tuple = True
+            else:
+                first = [ repr(X) ]
+                while items and items[0][0] == "append":
+                    first.append(items.pop(0)[1])
+                if rule[0] in transparent:
+                    code.append("tree = _TransparentNode((%s,))"
+                                %", ".join(first))
+                else:
+                    code.append("tree = [ %s ]"%", ".join(first))
+            for how,entry in items:
+                if how == "append":
+                    code.append("tree.append(%s)"%entry)
+                elif how == "extend":
+                    code.append("tree.extend(%s[1:])"%entry)
+                else:
+                    code.extend([
+                        "c = %s"%entry,
+                        "if type(c) is _TransparentNode:",
+                        "    tree.extend(c[1:])",
+                        "else:",
+                        "    tree.append(c)" ])
+            if rule[0] not in transparent and not is_tuple:
+                code.extend([
+                    "if hook is None:",
+                    "    tree = tuple(tree)",
+                    "else:",
+                    "    tree = hook(%s, tree[1:])"%repr(X) ])
+            code.extend(hook)
+            if n == 1:
+                code.append("stack[-1] = (s, tree)")
+            else:
+                code.append("stack[-%d:] = [ (s, tree) ]"%n)
+            code.append("return "+goto_code(X, None))
+            return code
+
+        def code_test(codes):
+            if len(codes) == 1:
+                return "code == %d"%codes[0]
+            return "code in { %s }"%", ".join("%d"%c for c in codes)
+
+        shifts = {}
+        for (state,X),next_state in self.stab.items():
+            shifts.setdefault(state, {}).setdefault(int(next_state),
+                                                    []).append(t_code[X])
+        reductions = {}
+        for (state,X),key in self.rtab.items():
+            reductions.setdefault(state, {}).setdefault(key,
+                                                        []).append(t_code[X])
+
+        default_fn = [ "None" ] * n_states
+        action_fn = [ "None" ] * n_states
+        for state in range(n_states):
+            if state == int(self.halting_state):
+                continue
+            fd.write('\n')
+            if state in self.default_tab:
+                header = "def _reduce%d(stack, hooks):"%state
+                body = reduce_code(self.default_tab[state], state)
+                default_fn[state] = "_reduce%d"%state
+            else:
+                header = "def _state%d(stack, code, lookahead, hooks):"%state
+                body = [ ]
+                cases = [ ]
+                targets = shifts.get(state, {})
+                if len(targets) > 3:
+                    # look up the target state instead of testing
+                    # the codes one by one
+                    pairs = sorted((c,next_state)
+                                   for next_state,codes in targets.items()
+                                   for c in codes)
+                    tt = [ "%d: %d"%pair for pair in pairs ]
+                    for l in split_it(tt, start1="_shift%d = { "%state,
+                                      end2=" }"):
+                        fd.write(l+'\n')
+                    body.extend([
+                        "next_state = _shift%d.get(code)"%state,
+                        "if next_state is not None:",
+                        "    stack.append((%d, lookahead))"%state,
+                        "    return -next_state" ])
+                    targets = { }
+                for next_state,codes in targets.items():
+                    lines = [ "stack.append((%d, lookahead))"%state,
+                              "return -%d"%next_state ]
+                    cases.append((sorted(codes), lines))
+                for key,codes in reductions.get(state, {}).items():
+                    cases.append((sorted(codes), reduce_code(key, state)))
+                # test for the most frequent cases first
+                cases.sort(key=lambda case: (-len(case[0]), case[0]))
+                for codes,lines in cases:
+                    body.append("if %s:"%code_test(codes))
+                    body.extend("    "+l for l in lines)
+                body.append("return 0")
+                action_fn[state] = "_state%d"%state
+            fd.write(header+'\n')
+            for l in body:
+                fd.write("    "+l+'\n')
+        fd.write('\n')
+        return default_fn, action_fn
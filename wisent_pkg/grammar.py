@@ -266,6 +266,9 @@ class Grammar(object):
         for s in self.nonterminals|self.terminals:
             self.fitab[s] = frozenset(fitab[s])
 
+        # precompute the first terminals of all rule suffixes
+        self.sutab = self._compute_sutab()
+
         # precompute the table of all possible follow-up symbols
         fotab = self._compute_fotab()
         self.fotab = {}
@@ -367,6 +370,29 @@ class Grammar(object):
                     done = False
         return fitab
 
+    def _compute_sutab(self):
+        """Compute the first terminals of all rule suffixes.
+
+        The keys of the returned dictionary are pairs `(key, n)`,
+        the values are pairs consisting of the set of first terminals
+        of `self.rules[key][n:]` and a flag which indicates whether
+        this suffix is nullable.
+        """
+        sutab = {}
+        for key, r in self.rules.items():
+            fi = frozenset()
+            nullable = True
+            sutab[(key,len(r))] = (fi, nullable)
+            for n in range(len(r)-1, 0, -1):
+                s = r[n]
+                if s in self.nullable:
+                    fi = self.fitab[s] | fi
+                else:
+                    fi = self.fitab[s]
+                    nullable = False
+                sutab[(key,n)] = (fi, nullable)
+        return sutab
+
     def _compute_fotab(self):
         fotab = {}
         for s in self.nonterminals|self.terminals:
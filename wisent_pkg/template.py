@@ -29,16 +29,31 @@
 # if advised of the possibility of such damage.
 
 from itertools import chain
+from time import time
 
 def print_tree(tree, terminals, indent=0):
     """Print a parse tree to stdout."""
-    prefix = "    "*indent
-    if tree[0] in terminals:
-        print(prefix + repr(tree))
-    else:
-        print(prefix + str(tree[0]))
-        for x in tree[1:]:
-            print_tree(x, terminals, indent+1)
+    terminals = frozenset(terminals)
+    todo = [ (tree, indent) ]
+    while todo:
+        tree, indent = todo.pop()
+        prefix = "    "*indent
+        if tree[0] in terminals:
+            print(prefix + repr(tree))
+        else:
+            print(prefix + str(tree[0]))
+            todo.extend((x, indent+1) for x in tree[:0:-1])
+
+class _TransparentNode(list):
+
+    """Internal list type for the nodes of transparent symbols.
+
+    While they are on the parser stack, the nodes for transparent
+    symbols are lists of this type, so that they can be told apart
+    from lists returned by semantic actions or by `nodes`.
+    """
+
+    __slots__ = ()
 
 class Parser(object):
 
@@ -75,21 +90,235 @@ class Parser(object):
             self.errors = errors
             self.tree = tree
 
-    def __init__(self, max_err=None, errcorr_pre=4, errcorr_post=4):
+        #@ IF api_many
+        def __reduce__(self):
+            # allow to pass exceptions between processes
+            return (self.__class__, (self.errors, self.tree))
+        #@ ENDIF
+
+    class _Input(object):
+
+        """Internal class to represent the remaining input of a parser.
+
+        The attribute `it` is an iterator over the input tokens.
+        Tokens can be put back in front of the remaining input using
+        `push`.  This replaces `it` by a new iterator, but the cost of
+        reading a token does not grow with the number of calls to
+        `push`.
+        """
+
+        def __init__(self, tokens):
+            self.tokens = iter(tokens)
+            self.pushed = iter(())
+            self.it = self.tokens
+
+        def push(self, tokens):
+            pushed = list(tokens)
+            pushed.extend(self.pushed)
+            self.pushed = iter(pushed)
+            self.it = chain(self.pushed, self.tokens)
+
+    class FlatTree(object):
+
+        """Parse tree stored in flat arrays, as returned by `parse_flat`.
+
+        The nodes for nonterminal symbols are numbered in postorder,
+        so that every node comes after its children and the root is
+        the last node.  For node `i`, `symbols[code[i]]` is the
+        symbol, the children are stored at positions `first[i]` to
+        `first[i]+count[i]-1` of `children`, and `token[i]` is the
+        index of the first token of the node in `tokens` (-1 for
+        nodes without tokens).  Entries `j >= 0` of `children` refer
+        to node `j`, entries `j < 0` to the token `tokens[-j-1]`.
+        `tokens` is the list of input tokens; tokens inserted by the
+        error recovery are stored there, too.  If the parse tree
+        consists of a single token, there are no nodes and the only
+        entry of `children` refers to this token.
+        """
+
+        class Node(object):
+
+            """Lightweight view of a node in a `FlatTree`.
+
+            Nodes can be used like the tuples of ordinary parse
+            trees: `node[0]` is the symbol and `node[1:]` are the
+            children, which are Node objects or tokens.
+            """
+
+            __slots__ = ('tree', 'index')
+
+            def __init__(self, tree, index):
+                self.tree = tree
+                self.index = index
+
+            def __len__(self):
+                return self.tree.count[self.index] + 1
+
+            def __getitem__(self, k):
+                if isinstance(k, slice):
+                    return tuple(self)[k]
+                if k < 0:
+                    k += len(self)
+                if k == 0:
+                    return self.tree.symbols[self.tree.code[self.index]]
+                if not 0 < k < len(self):
+                    raise IndexError("node index out of range")
+                return self.tree.child(self.tree.children[
+                        self.tree.first[self.index]+k-1])
+
+            def __iter__(self):
+                yield self[0]
+                tree = self.tree
+                start = tree.first[self.index]
+                for j in tree.children[start:start+tree.count[self.index]]:
+                    yield tree.child(j)
+
+            def __repr__(self):
+                return "<node %d: %s>"%(self.index, repr(self[0]))
+
+        def __init__(self, symbols):
+            from array import array
+            self.symbols = symbols
+            self.code = array('H')
+            self.first = array('i')
+            self.count = array('i')
+            self.token = array('i')
+            self.children = array('i')
+            self.tokens = []
+
+        def __len__(self):
+            return len(self.code)
+
+        def child(self, j):
+            """Return the Node or token for entry `j` of `children`."""
+            if j >= 0:
+                return self.Node(self, j)
+            return self.tokens[-j-1]
+
+        @property
+        def root(self):
+            """The root node of the tree, or the token if it has no nodes."""
+            if not self.code:
+                return self.child(self.children[-1])
+            return self.Node(self, len(self.code)-1)
+
+        def as_tuple(self, i=None):
+            """Convert the subtree at node `i` into nested tuples.
+
+            This gives the same parse tree as `Parser.parse`.  If `i`
+            is omitted, the whole tree is converted.
+            """
+            if i is None:
+                if not self.code:
+                    return self.root
+                i = len(self.code)-1
+            # The subtree is the range of nodes from the leftmost
+            # descendant of node i up to i.
+            j = i
+            while True:
+                start = self.first[j]
+                for c in self.children[start:start+self.count[j]]:
+                    if c >= 0:
+                        j = c
+                        break
+                else:
+                    break
+            nodes = []
+            for k in range(j, i+1):
+                node = [ self.symbols[self.code[k]] ]
+                start = self.first[k]
+                for c in self.children[start:start+self.count[k]]:
+                    if c >= 0:
+                        node.append(nodes[c-j])
+                    else:
+                        node.append(self.tokens[-c-1])
+                nodes.append(tuple(node))
+            return nodes[-1]
+
+    def __init__(self, max_err=None, errcorr_pre=4, errcorr_post=4,
+                 actions=None, errcorr_trials=None, errcorr_time=None,
+                 panic=False, nodes=None):
         """Create a new parser instance.
 
-        The constructor arguments are all optional, they control the
-        handling of parse errors: `max_err` can be given to bound the
-        number of errors reported during one run of the parser.
-        `errcorr_pre` controls how many tokens before an invalid token
-        the parser considers when trying to repair the input.
-        `errcorr_post` controls how far beyond an invalid token the
-        parser reads when evaluating the quality of an attempted
+        The constructor arguments are all optional.  The first three
+        control the handling of parse errors: `max_err` can be given
+        to bound the number of errors reported during one run of the
+        parser.  `errcorr_pre` controls how many tokens before an
+        invalid token the parser considers when trying to repair the
+        input.  `errcorr_post` controls how far beyond an invalid token
+        the parser reads when evaluating the quality of an attempted
         repair.
+
+        `errcorr_trials` and `errcorr_time` can be given to bound the
+        number of attempted repairs and the time in seconds spent on
+        the repair of a single error; once the bound is reached, the
+        best repair found so far is used.  If `panic` is true, no
+        repairs are attempted.  Instead, the parser discards input
+        tokens until it finds a synchronizing terminal which can be
+        parsed after discarding some of the innermost unfinished
+        constructs.  This is also done when a bound is reached before
+        any repair was found.  The end of input always acts as a
+        synchronizing terminal.
+
+        `actions` can be a dictionary which maps production rules
+        (tuples as listed in the class docstring) or nonterminal
+        symbols to functions.  Whenever a node for such a rule or
+        symbol is constructed, the function is called with the
+        children of the node as arguments, and the return value is
+        used in place of the node.  Actions cannot be attached to
+        transparent symbols.  Since the return values cannot be parsed
+        again, `errcorr_pre` is ignored if actions are given.
+
+        `nodes` can be a function which constructs the nodes of the
+        parse tree: for every node which is not handled by an action
+        it is called with the symbol and the children of the node as
+        arguments, and the return value is used in place of the tuple.
+        Nodes for transparent symbols are not passed to `nodes`.  As
+        for actions, `errcorr_pre` is ignored if `nodes` is given.
         """
         self.max_err = max_err
         self.m = errcorr_pre
         self.n = errcorr_post
+        self.max_trials = errcorr_trials
+        self.max_time = errcorr_time
+        self.panic = panic
+        self._hooks = None
+        if actions or nodes is not None:
+            self._hooks = self._action_hooks(actions or {}, nodes)
+            self.m = 0
+        self.reset()
+
+    def _action_hooks(self, actions, nodes=None):
+        """Internal function to convert the `actions` and `nodes`
+        arguments of the constructor into hooks for `_parse`.
+        """
+        hooks = {}
+        used = set()
+        for k,rule in enumerate(self._productions):
+            X = self._rules[k][0]
+            for key in (rule, rule[0], X):
+                if key in actions:
+                    break
+            else:
+                #@ IF transparent_tokens
+                if X in self._transparent:
+                    continue
+                #@ ENDIF
+                if nodes is not None:
+                    hooks[k] = lambda X, children: nodes(X, *children)
+                continue
+            used.add(key)
+            #@ IF transparent_tokens
+            if X in self._transparent:
+                msg = "cannot attach actions to transparent symbol %s"
+                raise ValueError(msg%repr(rule[0]))
+            #@ ENDIF
+            fn = actions[key]
+            hooks[k] = lambda X, children, fn=fn: fn(*children)
+        for key in actions:
+            if key not in used:
+                raise ValueError("invalid key %s in actions"%repr(key))
+        return hooks
 
     @staticmethod
     def leaves(tree):
@@ -98,72 +327,212 @@ class Parser(object):
         This function can be used to reconstruct the input from a
         parse tree.
         """
-        if tree[0] in Parser.terminals:
-            yield tree
-        else:
-            for x in tree[1:]:
-                for t in Parser.leaves(x):
-                    yield t
+        terminals = Parser._terminals
+        todo = [ tree ]
+        while todo:
+            tree = todo.pop()
+            if tree[0] in terminals:
+                yield tree
+            else:
+                todo.extend(tree[:0:-1])
 
-    def _parse(self, tokens, stack, state):
+    def _parse(self, tokens, stack, state, hooks=None):
         """Internal function to construct a parse tree.
 
         'Tokens' is the input token stream, 'stack' is the inital stack
-        and 'state' is the inital state of the automaton.
+        and 'state' is the inital state of the automaton.  'Hooks' can
+        be a dictionary which maps rule numbers (indices into `_rules`)
+        to functions; instead of constructing a node for the
+        corresponding rule, the function is called with the symbol and
+        the list of children, and the return value is used in place of
+        the node.  For transparent symbols, the function is called
+        with the symbol and the newly constructed node instead.
 
         Returns a 4-tuple (done, count, state, error).  'done' is a
         boolean indicationg whether parsing is completed, 'count' is
         number of successfully shifted tokens, and 'error' is None on
         success or else the first token which could not be parsed.
         """
+        #@ IF direct_code
+        # Every state of the automaton is implemented by a function of
+        # its own, see the definitions before the class.
+        reduce_tab = self._direct_default
+        action_tab = self._direct_action
+        token_codes = self.token_codes
+        halting_state = self._halting_state
+
         read_next = True
         count = 0
-        while state != self._halting_state:
+        while state != halting_state:
+            reduce = reduce_tab[state]
+            if reduce is not None:
+                state = reduce(stack, hooks)
+                continue
             if read_next:
                 try:
                     lookahead = next(tokens)
                 except StopIteration:
                     return (False,count,state,None)
                 read_next = False
-            token = lookahead[0]
+                code = token_codes.get(lookahead[0])
+                if code is None:
+                    return (False,count,state,lookahead)
+            next_state = action_tab[state](stack, code, lookahead, hooks)
+            if next_state > 0:
+                state = next_state
+            elif next_state < 0:
+                state = -next_state
+                read_next = True
+                count += 1
+            else:
+                return (False,count,state,lookahead)
+        return (True,count,state,None)
+        #@ ELSE
+        action_tab = self._action
+        default = self._default
+        rules = self._rules
+        goto = self._goto
+        #@ IF compact_tables
+        token_codes = self.token_codes
+        #@ ENDIF
+        #@ IF transparent_tokens
+        transparent = self._transparent
+        splice_tab = self._splice
+        #@ ENDIF
+        halting_state = self._halting_state
+
+        read_next = True
+        count = 0
+        while state != halting_state:
             #@ IF parser_debugprint
 
             debug = [ ]
             for s in stack:
                 debug.extend([str(s[0]), repr(s[1][0])])
             debug.append(str(state))
-            print(" ".join(debug)+" [%s]"%repr(token))
+            print(" ".join(debug))
             #@ ENDIF parser_debugprint
+            action = default[state]
+            if not action:
+                if read_next:
+                    try:
+                        lookahead = next(tokens)
+                    except StopIteration:
+                        return (False,count,state,None)
+                    read_next = False
+                    #@ IF compact_tables
+                    code = token_codes.get(lookahead[0])
+                    if code is None:
+                        return (False,count,state,lookahead)
+                    #@ ENDIF
+                token = lookahead[0]
+                #@ IF parser_debugprint
+                print("lookahead %s"%repr(token))
+                #@ ENDIF
 
-            if (state,token) in self._shift:
+                #@ IF compact_tables
+                action = action_tab[state][code]
+                #@ ELSE
+                action = action_tab.get((state,token), 0)
+                #@ ENDIF
+            if action > 0:
                 #@ IF parser_debugprint
                 print("shift %s"%repr(token))
                 #@ ENDIF
                 stack.append((state,lookahead))
-                state = self._shift[(state,token)]
+                state = action
                 read_next = True
                 count += 1
-            elif (state,token) in self._reduce:
-                X,n = self._reduce[(state,token)]
+            elif action < 0:
+                #@ IF compact_tables
+                X,n,X_code = rules[-action-1]
+                #@ ELSE
+                X,n = rules[-action-1]
+                #@ ENDIF
+                if hooks:
+                    hook = hooks.get(-action-1)
+                else:
+                    hook = None
                 if n > 0:
                     state = stack[-n][0]
                     #@ IF transparent_tokens
-                    tree = [ X ]
-                    for s in stack[-n:]:
-                        if s[1][0] in self._transparent:
-                            tree.extend(s[1][1:])
-                        else:
+                    # Transparent nodes are kept as lists of type
+                    # _TransparentNode while they are on the stack, so
+                    # that left-recursive repetitions like
+                    # "_4* -> _4* _item" can be extended in place.
+                    # The entries of `splice` tell which children are
+                    # transparent nodes (1), or might be (2).
+                    splice = splice_tab[-action-1]
+                    if splice is None:
+                        tree = [ X ]
+                        for s in stack[-n:]:
                             tree.append(s[1])
-                    tree = tuple(tree)
+                    else:
+                        tree = stack[-n][1]
+                        if splice[0] and type(tree) is _TransparentNode \
+                                and tree[0] == X:
+                            k = 1
+                        else:
+                            tree = [ X ]
+                            k = 0
+                        for i in range(k, n):
+                            c = stack[i-n][1]
+                            if splice[i] == 1 or \
+                                    (splice[i] == 2 and
+                                     type(c) is _TransparentNode):
+                                tree.extend(c[1:])
+                            else:
+                                tree.append(c)
+                    if X in transparent:
+                        if type(tree) is not _TransparentNode:
+                            tree = _TransparentNode(tree)
+                        if hook is not None:
+                            tree = hook(X, tree)
+                    elif hook is None:
+                        tree = tuple(tree)
+                    else:
+                        tree = hook(X, tree[1:])
                     #@ ELSE
-                    tree = (X,) + tuple(s[1] for s in stack[-n:])
+                    if hook is None:
+                        tree = (X,) + tuple(s[1] for s in stack[-n:])
+                    else:
+                        tree = hook(X, [ s[1] for s in stack[-n:] ])
                     #@ ENDIF
                     #@ IF parser_debugprint
                     debug = [ s[1][0] for s in stack[-n:] ]
                     #@ ENDIF
                     del stack[-n:]
+                #@ IF unit_relabel
+                elif n < 0:
+                    # The reduction by this unit rule was removed by
+                    # the parser generator: the node on top of the
+                    # stack stands in for the node for X.
+                    #@ IF parser_debugprint
+                    print("skip unit rule for %s"%repr(X))
+                    #@ ENDIF
+                    #@ IF compact_tables
+                    state = goto[stack[-1][0]][X_code]
+                    #@ ELSE
+                    state = goto[(stack[-1][0],X)]
+                    #@ ENDIF
+                    continue
+                #@ ENDIF
                 else:
-                    tree = (X,)
+                    #@ IF transparent_tokens
+                    if X in transparent:
+                        tree = _TransparentNode((X,))
+                        if hook is not None:
+                            tree = hook(X, tree)
+                    elif hook is None:
+                        tree = (X,)
+                    else:
+                        tree = hook(X, [])
+                    #@ ELSE
+                    if hook is None:
+                        tree = (X,)
+                    else:
+                        tree = hook(X, [])
+                    #@ ENDIF
                     #@ IF parser_debugprint
                     debug = [ ]
                     #@ ENDIF
@@ -171,33 +540,418 @@ class Parser(object):
                 print("reduce %s -> %s"%(repr(debug),repr(X)))
                 #@ ENDIF
                 stack.append((state,tree))
-                state = self._goto[(state,X)]
+                #@ IF compact_tables
+                state = goto[state][X_code]
+                #@ ELSE
+                state = goto[(state,X)]
+                #@ ENDIF
             else:
                 #@ IF parser_debugprint
                 print("parse error")
                 #@ ENDIF
                 return (False,count,state,lookahead)
         return (True,count,state,None)
+        #@ ENDIF
 
-    def _try_parse(self, tokens, stack, state):
-        count = 0
-        while state != self._halting_state and count < len(tokens):
-            token = tokens[count][0]
+    def _try_parse(self, tokens, stack, base, top, state):
+        """Internal function to test how far 'tokens' can be parsed.
 
-            if (state,token) in self._shift:
-                stack.append(state)
-                state = self._shift[(state,token)]
+        The stack of the automaton consists of the states in
+        stack[:base], which are not modified, followed by the states
+        in the list 'top'.  Returns a 4-tuple (count, base, top, state)
+        where 'count' is the number of tokens which could be shifted
+        and the other entries describe the resulting configuration.
+        """
+        count = 0
+        while state != self._halting_state:
+            action = self._default[state]
+            if not action:
+                if count == len(tokens):
+                    break
+                token = tokens[count][0]
+                #@ IF compact_tables
+                code = self.token_codes.get(token)
+                if code is None:
+                    break
+                action = self._action[state][code]
+                #@ ELSE
+                action = self._action.get((state,token), 0)
+                #@ ENDIF
+            if action > 0:
+                top.append(state)
+                state = action
                 count += 1
-            elif (state,token) in self._reduce:
-                X,n = self._reduce[(state,token)]
-                if n > 0:
-                    state = stack[-n]
-                    del stack[-n:]
-                stack.append(state)
+            elif action < 0:
+                #@ IF compact_tables
+                X,n,X_code = self._rules[-action-1]
+                #@ ELSE
+                X,n = self._rules[-action-1]
+                #@ ENDIF
+                if n > len(top):
+                    base -= n-len(top)
+                    state = stack[base]
+                    del top[:]
+                elif n > 0:
+                    state = top[-n]
+                    del top[-n:]
+                #@ IF unit_relabel
+                elif n < 0:
+                    if top:
+                        state = top.pop()
+                    else:
+                        base -= 1
+                        state = stack[base]
+                #@ ENDIF
+                top.append(state)
+                #@ IF compact_tables
+                state = self._goto[state][X_code]
+                #@ ELSE
                 state = self._goto[(state,X)]
+                #@ ENDIF
+            else:
+                break
+        return (count, base, top, state)
+
+    def _backtrack(self, stack, state, lookahead, pre):
+        """Internal function to undo the last steps of the parser.
+
+        'Stack' and 'state' describe the parser when it found the
+        invalid token 'lookahead'.  Returns a 3-tuple (stack, state,
+        queue), where 'stack' and 'state' describe the parser before
+        the last 'pre' tokens were read, and 'queue' is the list of
+        these tokens followed by 'lookahead'.
+
+        Only the end of the input is parsed again: the entries at the
+        top of the stack are taken apart, where the states for the
+        children of a node are found in the tables.  This is not
+        possible for nodes with spliced transparent children, whose
+        tokens are parsed again instead.
+        """
+        terminals = self._terminals
+        rules = self._rules
+        goto = self._goto
+        #@ IF compact_tables
+        token_codes = self.token_codes
+        nt_codes = dict((rule[0],rule[2]) for rule in rules)
+        #@ ENDIF
+
+        # shape[X] is None if the children of every node for X are
+        # the nodes for the symbols of a rule, and (b,m) for
+        # repetitions which start with b such children and are then
+        # extended by m children at a time.
+        shape = {}
+        #@ IF transparent_tokens
+        kinds = {}
+        for k,rule in enumerate(self._productions):
+            X,n = rules[k][0],rules[k][1]
+            if n < 0:
+                continue
+            splice = self._splice[k]
+            if splice is None:
+                kind = (0,n)
+            elif rule[1] == rule[0] and splice[0] == 1 \
+                    and not any(splice[1:]):
+                kind = (1,n-1)
+            else:
+                kind = None
+            kinds.setdefault(X, set()).add(kind)
+        for X,ks in kinds.items():
+            if None in ks:
+                continue
+            base = set(n for r,n in ks if r == 0)
+            step = set(n for r,n in ks if r == 1)
+            if not step:
+                shape[X] = None
+            elif len(base) == 1 and len(step) == 1:
+                shape[X] = (base.pop(), step.pop())
+        #@ ELSE
+        for rule in rules:
+            shape[rule[0]] = None
+        #@ ENDIF
+
+        def last_leaves(tree, k, res):
+            # collect the last k leaves of tree, in reverse order
+            if tree[0] in terminals:
+                res.append(tree)
+                return
+            for i in range(len(tree)-1, 0, -1):
+                if len(res) >= k:
+                    break
+                last_leaves(tree[i], k, res)
+
+        def split_off(tree, k, queue):
+            # Find the child of 'tree' which contains the last token
+            # before the last k leaves, and prepend these leaves to the
+            # queue.  Returns the index of the child and the number of
+            # its leaves which are in the queue.
+            for i in range(len(tree)-1, 0, -1):
+                res = []
+                last_leaves(tree[i], k+1, res)
+                if len(res) > k:
+                    return i, k
+                res.reverse()
+                queue[0:0] = res
+                k -= len(res)
+
+        def transition(state, tree, following):
+            # the state after 'tree' was pushed in 'state'
+            X = tree[0]
+            if X in terminals:
+                #@ IF compact_tables
+                new_state = self._action[state][token_codes[X]]
+                #@ ELSE
+                new_state = self._action.get((state,X), 0)
+                #@ ENDIF
+            else:
+                #@ IF compact_tables
+                new_state = goto[state][nt_codes[X]]
+                #@ ELSE
+                new_state = goto.get((state,X), 0)
+                #@ ENDIF
+            #@ IF unit_relabel
+            # The parser might skip unit rules, depending on the
+            # following token.
+            lookahead = None
+            for t in following:
+                lookahead = first_leaf(t)
+                if lookahead is not None:
+                    break
+            while new_state > 0:
+                action = self._default[new_state]
+                if not action:
+                    if lookahead is None:
+                        break
+                    #@ IF compact_tables
+                    code = token_codes[lookahead[0]]
+                    action = self._action[new_state][code]
+                    #@ ELSE
+                    action = self._action.get((new_state,lookahead[0]), 0)
+                    #@ ENDIF
+                if action >= 0 or rules[-action-1][1] >= 0:
+                    break
+                #@ IF compact_tables
+                new_state = goto[state][rules[-action-1][2]]
+                #@ ELSE
+                new_state = goto[(state,rules[-action-1][0])]
+                #@ ENDIF
+            #@ ENDIF
+            return new_state
+
+        def first_leaf(tree):
+            if tree[0] in terminals:
+                return tree
+            for t in tree[1:]:
+                t = first_leaf(t)
+                if t is not None:
+                    return t
+            return None
+
+        # Remove the stack entries which only contain tokens of the
+        # queue.
+        queue = [ lookahead ]
+        need = pre
+        base = len(stack)
+        while base > 0:
+            res = []
+            last_leaves(stack[base-1][1], need+1, res)
+            if len(res) > need:
+                break
+            res.reverse()
+            queue[0:0] = res
+            need -= len(res)
+            base -= 1
+        entries = stack[:base]
+        if base == 0:
+            _,_,state,_ = self._parse(iter(()), entries, 0)
+            return (entries, state, queue)
+
+        # Follow the last token before the queue down the tree of the
+        # topmost remaining entry.
+        state,node = entries.pop()
+        while node[0] not in terminals and node[0] in shape:
+            part = list(queue)
+            i,k = split_off(node, need, part)
+            start = 1
+            if shape[node[0]] is not None:
+                b,m = shape[node[0]]
+                if i > b:
+                    if type(node) is not _TransparentNode:
+                        break
+                    start = b+1 + (i-b-1)//m*m
+                    children = node[start:i+1]
+                    del node[start:]
+                    entries.append((state,node))
+                    state = transition(state, node, children)
+                    node = [ None ] + children
+                    i = len(node)-1
+                    start = 1
+            pushed = []
+            s = state
+            for j in range(start, i):
+                new_state = transition(s, node[j], node[j+1:i+1])
+                if not new_state:
+                    break
+                pushed.append((s,node[j]))
+                s = new_state
             else:
+                entries.extend(pushed)
+                queue, need, state, node = part, k, s, node[i]
+                continue
+            break
+        prefix = list(self.leaves(node))
+        k = len(prefix)-need
+        queue[0:0] = prefix[k:]
+        _,_,state,_ = self._parse(iter(prefix[:k]), entries, state)
+        return (entries, state, queue)
+
+    def _recover(self, errors, stack, state, lookahead, tokens, pre):
+        """Internal function to recover from a parse error.
+
+        'Errors' is the list of errors found so far, 'stack' and
+        'state' describe the parser when it found the invalid token
+        'lookahead', and 'tokens' is the `_Input` object for the
+        remaining input.  Repairs are tried for the 'pre' tokens before
+        the invalid one, and at most `errcorr_post` tokens are read
+        from 'tokens'.
+
+        The error is appended to 'errors' and the repaired input is
+        pushed back into 'tokens'.  Returns a 2-tuple (stack, state)
+        from where parsing can continue, or None if panic-mode
+        recovery needs more input than 'tokens' provides.  ParseErrors
+        is raised if there are too many errors or if no repair could
+        be found.
+        """
+        expect = list(self._expected[state])
+        #@ IF error_stacks
+        #@ IF transparent_tokens
+        trees = [ tuple(s[1]) if type(s[1]) is _TransparentNode else s[1]
+                  for s in stack ]
+        #@ ELSE
+        trees = [ s[1] for s in stack ]
+        #@ ENDIF
+        errors.append((lookahead, expect, trees))
+        #@ ELSE
+        errors.append((lookahead, expect))
+        #@ ENDIF
+        if self.max_err is not None and len(errors) >= self.max_err:
+            raise self.ParseErrors(errors, None)
+        if self.panic:
+            return self._panic(errors, stack, state, lookahead, tokens)
+
+        #@ IF parser_debugprint
+        print("backtrack for error recovery")
+        #@ ENDIF
+        if pre > 0:
+            stack,state,queue = self._backtrack(stack, state, lookahead, pre)
+        else:
+            queue = [ lookahead ]
+        m = len(queue)
+        for i in range(0, self.n):
+            try:
+                queue.append(next(tokens.it))
+            except StopIteration:
                 break
-        return count
+
+        # Repairs are tried from right to left.  The configuration of
+        # the automaton before every position is computed only once.
+        # Insertions or replacements of tokens which are invalid in
+        # this configuration are not tried, since these cannot get
+        # further than the unrepaired input.
+        states = [ s[0] for s in stack ]
+        _,base,top,next_state = self._try_parse([], states, len(states),
+                                                [], state)
+        configs = [ (base,top[:],next_state) ]
+        for i in range(0, m-1):
+            _,base,top,next_state = self._try_parse(queue[i:i+1], states,
+                                                    base, top, next_state)
+            configs.append((base,top[:],next_state))
+        best_val = len(queue)-m+1
+        best_queue = queue
+        trials = self.max_trials
+        if self.max_time is not None:
+            deadline = time() + self.max_time
+        else:
+            deadline = None
+        exhausted = False
+        for i in range(m-1, -1, -1):
+            base,top,next_state = configs[i]
+            valid = frozenset(self._expected[next_state] or self.terminals)
+            tails = [ [(t,)]+queue[i:] for t in self.terminals if t in valid ]
+            if queue[i][0] != self.EOF:
+                tails.extend([(t,)]+queue[i+1:] for t in self.terminals
+                             if t in valid and t != queue[i][0])
+                tails.append(queue[i+1:])
+            for tail in tails:
+                count,_,_,_ = self._try_parse(tail, states, base, top[:],
+                                              next_state)
+                val = len(tail) - count
+                if val < best_val:
+                    best_val = val
+                    best_queue = queue[:i]+tail
+                    if val == 0 or val == i+len(tail):
+                        break
+                if trials is not None:
+                    trials -= 1
+                    exhausted = trials <= 0
+                if deadline is not None and time() > deadline:
+                    exhausted = True
+                if exhausted:
+                    break
+            else:
+                continue
+            break
+        if best_val >= len(queue)-m+1:
+            if not exhausted:
+                raise self.ParseErrors(errors, None)
+            # return to the invalid token and discard input instead
+            tokens.push(queue[m:])
+            _,_,state,lookahead = self._parse(iter(queue[:m]), stack, state)
+            return self._panic(errors, stack, state, lookahead, tokens)
+        #@ IF parser_debugprint
+        debug = " ".join(repr(x[0]) for x in best_queue)
+        print("restart with repaired input: "+debug)
+        #@ ENDIF
+        tokens.push(best_queue)
+        return (stack, state)
+
+    def _panic(self, errors, stack, state, lookahead, tokens):
+        """Internal function for panic-mode error recovery.
+
+        Starting with 'lookahead', input tokens are discarded until a
+        synchronizing terminal (or the end of input), or the token
+        after a synchronizing terminal, is found which can be parsed
+        after removing some entries from the top of 'stack'.  This
+        token is pushed back into 'tokens', and a 2-tuple (stack,
+        state) is returned from where parsing can continue.  If
+        'tokens' is exhausted before, None is returned.  ParseErrors
+        is raised if not even the end of input can be parsed.
+        """
+        states = [ s[0] for s in stack ]
+        token = lookahead
+        after_sync = False
+        while True:
+            is_sync = token[0] in self._sync or token[0] == self.EOF
+            if is_sync or after_sync:
+                for k in range(len(states), -1, -1):
+                    if k < len(states):
+                        new_state = states[k]
+                    else:
+                        new_state = state
+                    count,_,_,_ = self._try_parse([token], states, k, [],
+                                                  new_state)
+                    if count:
+                        #@ IF parser_debugprint
+                        print("panic mode: continue at %s"%repr(token[0]))
+                        #@ ENDIF
+                        del stack[k:]
+                        tokens.push([token])
+                        return (stack, new_state)
+                if token[0] == self.EOF:
+                    raise self.ParseErrors(errors, None)
+            after_sync = is_sync
+            token = next(tokens.it, None)
+            if token is None:
+                return None
 
     def parse(self, tokens):
         """Parse the tokens from `tokens` and construct a parse tree.
@@ -211,75 +965,714 @@ class Parser(object):
         Otherwise the function returns the parse tree.
         """
         errors = []
-        tokens = chain(tokens, [(self.EOF,)])
+        tokens = self._Input(chain(tokens, [(self.EOF,)]))
         stack = []
         state = 0
         while True:
-            done,_,state,lookahead = self._parse(tokens, stack, state)
+            done,_,state,lookahead = self._parse(tokens.it, stack, state,
+                                                 self._hooks)
             if done:
                 break
+            stack,state = self._recover(errors, stack, state, lookahead,
+                                        tokens, self.m)
 
-            expect = [ t for s,t in list(self._reduce.keys())+list(self._shift.keys())
-                       if s == state ]
-            #@ IF error_stacks
-            errors.append((lookahead, expect, [ s[1] for s in stack ]))
-            #@ ELSE
-            errors.append((lookahead, expect))
+        tree = stack[0][1]
+        if errors:
+            raise self.ParseErrors(errors, tree)
+        return tree
+
+    def parse_iter(self, tokens, symbol):
+        """Parse `tokens` and iterate over the subtrees for `symbol`.
+
+        `tokens` has the same form as for `parse`, and `symbol` must
+        be a nonterminal symbol of the grammar which is not
+        transparent.  Every parse tree for `symbol` is returned as
+        soon as it has been constructed, and is then removed from the
+        parser state: in the enclosing parse tree, the subtree is
+        replaced by `(symbol,)`, and for repetitions of `symbol` (from
+        the operators `*` and `+`) the subtree is left out completely.
+        Thus the memory used by the parser does not grow with the
+        number of subtrees returned.
+
+        Since the tokens of returned subtrees are no longer available,
+        error recovery only considers tokens from the invalid one
+        onwards (i.e. `errcorr_pre` is ignored).  After all subtrees
+        have been returned, a ParseErrors exception is raised if the
+        input was invalid.
+
+        No nodes are constructed for unit rules which were removed by
+        the parser generator, so their subtrees are not returned.
+        ValueError is raised if all rules for `symbol` were removed.
+        """
+        #@ IF replace_nonterminals
+        for code,X in self.nonterminals.items():
+            if X == symbol:
+                symbol = code
+        #@ ENDIF
+        found = []
+        stub = (symbol,)
+        def detach(X, children):
+            found.append((X,) + tuple(children))
+            return stub
+        def detach_value(hook):
+            def detach(X, children):
+                found.append(hook(X, children))
+                return stub
+            return detach
+        #@ IF transparent_tokens
+        def drop_stubs(n):
+            def drop(X, tree):
+                for i in range(len(tree)-1, max(len(tree)-n,1)-1, -1):
+                    if tree[i] is stub:
+                        del tree[i]
+                return tree
+            return drop
+        #@ ENDIF
+        if not any(rule[0] == symbol for rule in self._rules):
+            raise ValueError("invalid nonterminal %s"%repr(symbol))
+        #@ IF transparent_tokens
+        if symbol in self._transparent:
+            msg = "cannot iterate over transparent symbol %s"
+            raise ValueError(msg%repr(symbol))
+        #@ ENDIF
+        #@ IF unit_relabel
+        if all(rule[1] < 0 for rule in self._rules if rule[0] == symbol):
+            raise ValueError("all rules for %s were removed"%repr(symbol))
+        #@ ENDIF
+        hooks = dict(self._hooks or {})
+        for k,rule in enumerate(self._rules):
+            if rule[0] == symbol:
+                if k in hooks:
+                    hooks[k] = detach_value(hooks[k])
+                else:
+                    hooks[k] = detach
+            #@ IF transparent_tokens
+            elif rule[0] in self._transparent and rule[1] > 0:
+                hooks[k] = drop_stubs(rule[1])
             #@ ENDIF
-            if self.max_err is not None and len(errors) >= self.max_err:
-                raise self.ParseErrors(errors, None)
 
-            #@ IF parser_debugprint
-            print("backtrack for error recovery")
+        def source(tokens):
+            # interrupt the parser after every new subtree
+            for token in tokens:
+                yield token
+                if found:
+                    return
+
+        errors = []
+        tokens = self._Input(chain(tokens, [(self.EOF,)]))
+        stack = []
+        state = 0
+        while True:
+            done,_,state,lookahead = self._parse(source(tokens.it), stack,
+                                                 state, hooks)
+            while found:
+                yield found.pop(0)
+            if done:
+                break
+            if lookahead is not None:
+                stack,state = self._recover(errors, stack, state,
+                                            lookahead, tokens, 0)
+
+        if errors:
+            raise self.ParseErrors(errors, stack[0][1])
+
+    def parse_flat(self, tokens):
+        """Parse the tokens from `tokens` into a `FlatTree`.
+
+        `tokens` has the same form as for `parse`, and the result
+        describes the same parse tree, but uses much less memory.
+        Semantic actions and the `nodes` argument of the constructor
+        are not used.  Since the nodes cannot be parsed again, error
+        recovery only considers tokens from the invalid one onwards
+        (i.e. `errcorr_pre` is ignored).  If `tokens` is invalid, a
+        ParseErrors exception is raised, with `tree` set to a
+        `FlatTree` or None.
+        """
+        symbols = []
+        hooks = {}
+        for k,rule in enumerate(self._rules):
+            X = rule[0]
+            #@ IF transparent_tokens
+            if X in self._transparent:
+                continue
             #@ ENDIF
-            queue = []
-            def split_input(m, stack, lookahead, queue):
-                for s in stack:
-                    for t in self.leaves(s[1]):
-                        queue.append(t)
-                        if len(queue) > m:
-                            yield queue.pop(0)
-                queue.append(lookahead)
-            in2 = split_input(self.m, stack, lookahead, queue)
-            stack = []
-            done,_,state,lookahead = self._parse(in2, stack, 0)
-            m = len(queue)
-            for i in range(0, self.n):
-                try:
-                    queue.append(next(tokens))
-                except StopIteration:
+            if X not in symbols:
+                symbols.append(X)
+            hooks[k] = symbols.index(X)
+        tree = self.FlatTree(symbols)
+        code = tree.code
+        first = tree.first
+        count = tree.count
+        start = tree.token
+        children = tree.children
+        seen = tree.tokens
+
+        # Input tokens are replaced by tuples (X, k), where k is the
+        # index of the token in `seen`.  Tokens inserted by the error
+        # recovery have length 1.
+        def source(tokens):
+            for token in tokens:
+                seen.append(token)
+                yield (token[0], len(seen)-1)
+        def record(nodes, X_code):
+            first.append(len(children))
+            count.append(len(nodes))
+            s = -1
+            for c in nodes:
+                if type(c) is int:
+                    if s < 0:
+                        s = start[c]
+                else:
+                    if len(c) == 1:
+                        seen.append(c)
+                        c = (c[0], len(seen)-1)
+                    if s < 0:
+                        s = c[1]
+                    c = -c[1]-1
+                children.append(c)
+            start.append(s)
+            code.append(X_code)
+            return len(code)-1
+        for k,X_code in hooks.items():
+            hooks[k] = lambda X, nodes, X_code=X_code: record(nodes, X_code)
+
+        errors = []
+        tokens = self._Input(chain(source(tokens), [(self.EOF,)]))
+        stack = []
+        state = 0
+        try:
+            while True:
+                done,_,state,lookahead = self._parse(tokens.it, stack,
+                                                     state, hooks)
+                if done:
                     break
+                stack,state = self._recover(errors, stack, state,
+                                            lookahead, tokens, 0)
+            node = stack[0][1]
+            if type(node) is not int:
+                # the parse tree consists of a single token
+                if len(node) == 1:
+                    seen.append(node)
+                    node = (node[0], len(seen)-1)
+                children.append(-node[1]-1)
+        except self.ParseErrors:
+            tree = None
+        for k,e in enumerate(errors):
+            if len(e[0]) == 2:
+                errors[k] = (seen[e[0][1]],) + e[1:]
+        if errors:
+            raise self.ParseErrors(errors, tree)
+        return tree
 
-            def vary_queue(queue, m):
-                for i in range(m-1, -1, -1):
-                    for t in self.terminals:
-                        yield queue[:i]+[(t,)]+queue[i:]
-                    if queue[i][0] == self.EOF:
+    def parse_events(self, tokens):
+        """Parse `tokens` and iterate over a stream of parse events.
+
+        `tokens` has the same form as for `parse`.  Instead of a parse
+        tree, this generator returns the events ('enter', X),
+        ('token', token) and ('exit', X) for the nodes of the tree in
+        document order, where X is a nonterminal symbol.  No events
+        are generated for transparent symbols.
+
+        The events for a part of the input are returned as soon as
+        the parser knows all nodes enclosing it.  For repetitions like
+        "_stmts -> _stmts stmt" this is the case once a `stmt` is
+        complete, so that the memory used does not grow with the
+        number of repetitions.  Error recovery only considers tokens
+        from the invalid one onwards (i.e. `errcorr_pre` is ignored).
+        After all events have been returned, a ParseErrors exception
+        is raised if the input was invalid.
+        """
+        action_tab = self._action
+        default = self._default
+        rules = self._rules
+        goto = self._goto
+        #@ IF compact_tables
+        token_codes = self.token_codes
+        #@ ENDIF
+        #@ IF transparent_tokens
+        transparent = self._transparent
+        #@ ENDIF
+        parents = self._parents
+        halting_state = self._halting_state
+
+        def next_state(state, X_code):
+            #@ IF compact_tables
+            row = goto[state]
+            if row is None:
+                return None
+            return row[X_code]
+            #@ ELSE
+            return goto.get((state,X_code))
+            #@ ENDIF
+
+        def parent(stack, i, state):
+            # Find the nearest visible ancestor of stack entry i, where
+            # 'state' is the state after this entry.  Returns a 3-tuple
+            # (X, k, X_code) where k is the stack position of the new
+            # node, None for the root, or False if the ancestor is not
+            # yet known.
+            found = {}
+            todo = [ (i, state) ]
+            seen = set()
+            while todo:
+                i, state = todo.pop()
+                if (i, state) in seen:
+                    continue
+                seen.add((i, state))
+                for k,n in parents[state]:
+                    if k < 0:
+                        found[None] = None
                         continue
-                    for t in self.terminals:
-                        if t == queue[i]:
-                            continue
-                        yield queue[:i]+[(t,)]+queue[i+1:]
-                    yield queue[:i]+queue[i+1:]
-            best_val = len(queue)-m+1
-            best_queue = queue
-            for q2 in vary_queue(queue, m):
-                pos = self._try_parse(q2, [ s[0] for s in stack ], state)
-                val = len(q2) - pos
-                if val < best_val:
-                    best_val = val
-                    best_queue = q2
-                    if val == len(q2):
+                    #@ IF compact_tables
+                    X,m,X_code = rules[k]
+                    #@ ELSE
+                    X,m = rules[k]
+                    X_code = X
+                    #@ ENDIF
+                    #@ IF transparent_tokens
+                    hidden = m < 0 or X in transparent
+                    #@ ELSE
+                    hidden = m < 0
+                    #@ ENDIF
+                    if hidden:
+                        # no node is constructed for X
+                        s = next_state(stack[i-n][0], X_code)
+                        if s is None:
+                            return False
+                        todo.append((i-n, s))
+                    else:
+                        found[(X, i-n)] = X_code
+                if len(found) > 1:
+                    return False
+            if not found:
+                return False
+            key, X_code = found.popitem()
+            if key is None:
+                return None
+            return key + (X_code,)
+
+        def ancestors(stack, i, state, opened):
+            # Return the visible ancestors (X, k) of stack entry i
+            # below the innermost opened node, from the top downwards,
+            # or None if they are not yet known or not below it.
+            if opened:
+                top = opened[-1]
+            else:
+                top = None
+            res = []
+            while True:
+                p = parent(stack, i, state)
+                if p is None:
+                    if top is not None:
+                        return None
+                    break
+                if p is False:
+                    return None
+                X, i, X_code = p
+                if top is not None:
+                    if (X, i) == top:
                         break
-            if best_val >= len(queue)-m+1:
-                raise self.ParseErrors(errors, None)
-            tokens = chain(best_queue, tokens)
-            #@ IF parser_debugprint
-            debug = " ".join(repr(x[0]) for x in best_queue)
-            print("restart with repaired input: "+debug)
-            #@ ENDIF
+                    if i < top[1]:
+                        return None
+                res.append((X, i))
+                state = next_state(stack[i][0], X_code)
+                if state is None:
+                    return None
+            res.reverse()
+            return res
 
-        tree = stack[0][1]
+        def flatten(events, out):
+            todo = [ events ]
+            while todo:
+                events = todo.pop()
+                if type(events) is list:
+                    todo.extend(reversed(events))
+                else:
+                    out.append(events)
+
+        # Every stack entry holds the events for its subtree, as an
+        # event or a list which may contain nested lists, or None once
+        # the events have been returned.  The events for the first
+        # `done` stack entries have been returned, and `opened` lists
+        # the nodes (X, k) which have been entered but not yet exited,
+        # where k is the stack position of the node.
+        errors = []
+        tokens = self._Input(chain(tokens, [(self.EOF,)]))
+        stack = []
+        state = 0
+        done = 0
+        opened = []
+        out = []
+        read_next = True
+        while state != halting_state:
+            action = default[state]
+            if not action:
+                if read_next:
+                    # return the events for all entries with known
+                    # ancestors
+                    while done < len(stack):
+                        if done+1 < len(stack):
+                            after = stack[done+1][0]
+                        else:
+                            after = state
+                        path = ancestors(stack, done, after, opened)
+                        if path is None:
+                            break
+                        for X,k in path:
+                            out.append(('enter', X))
+                            opened.append((X, k))
+                        flatten(stack[done][1], out)
+                        stack[done] = (stack[done][0], None)
+                        done += 1
+                    for event in out:
+                        yield event
+                    del out[:]
+
+                    lookahead = next(tokens.it)
+                    read_next = False
+                    #@ IF compact_tables
+                    code = token_codes.get(lookahead[0])
+                    #@ ENDIF
+                #@ IF compact_tables
+                if code is None:
+                    action = 0
+                else:
+                    action = action_tab[state][code]
+                #@ ELSE
+                action = action_tab.get((state,lookahead[0]), 0)
+                #@ ENDIF
+            if action > 0:
+                stack.append((state, ('token', lookahead)))
+                state = action
+                read_next = True
+            elif action < 0:
+                #@ IF compact_tables
+                X,n,X_code = rules[-action-1]
+                #@ ELSE
+                X,n = rules[-action-1]
+                X_code = X
+                #@ ENDIF
+                #@ IF unit_relabel
+                if n < 0:
+                    # no node is constructed for X
+                    state = next_state(stack[-1][0], X_code)
+                    continue
+                #@ ENDIF
+                #@ IF transparent_tokens
+                visible = X not in transparent
+                #@ ELSE
+                visible = True
+                #@ ENDIF
+                k = len(stack)-n
+                if n > 0:
+                    state = stack[k][0]
+                if done > k:
+                    # the node has been entered already
+                    for s in stack[done:]:
+                        flatten(s[1], out)
+                    while opened and opened[-1][1] > k:
+                        out.append(('exit', opened.pop()[0]))
+                    if visible and opened and opened[-1] == (X, k):
+                        out.append(('exit', X))
+                        opened.pop()
+                    events = None
+                    done = k+1
+                elif visible:
+                    events = [ ('enter', X) ]
+                    events.extend(s[1] for s in stack[k:])
+                    events.append(('exit', X))
+                elif n > 0:
+                    events = stack[k][1]
+                    if type(events) is not list:
+                        events = [ events ]
+                    events.extend(s[1] for s in stack[k+1:])
+                else:
+                    events = [ ]
+                del stack[k:]
+                stack.append((state, events))
+                state = next_state(state, X_code)
+            else:
+                stack,state = self._recover(errors, stack, state,
+                                            lookahead, tokens, 0)
+                done = min(done, len(stack))
+                while opened and opened[-1][1] >= len(stack):
+                    out.append(('exit', opened.pop()[0]))
+                read_next = True
+
+        if done == 0:
+            flatten(stack[0][1], out)
+        while opened:
+            out.append(('exit', opened.pop()[0]))
+        for event in out:
+            yield event
+        if errors:
+            raise self.ParseErrors(errors, None)
+
+    def validate(self, tokens):
+        """Check whether `tokens` is a valid input for the parser.
+
+        `tokens` has the same form as for `parse`.  The automaton is
+        run on a stack of states only: no parse tree is constructed,
+        the tokens are not kept and no semantic actions are called.
+        If `tokens` is invalid, a ParseErrors exception describing the
+        first error is raised, with `tree` set to None.  There is no
+        error recovery.
+        """
+        action_tab = self._action
+        default = self._default
+        rules = self._rules
+        goto = self._goto
+        #@ IF compact_tables
+        token_codes = self.token_codes
+        #@ ENDIF
+        halting_state = self._halting_state
+
+        tokens = chain(tokens, [(self.EOF,)])
+        stack = []
+        state = 0
+        read_next = True
+        while state != halting_state:
+            action = default[state]
+            if not action:
+                if read_next:
+                    lookahead = next(tokens)
+                    read_next = False
+                    #@ IF compact_tables
+                    code = token_codes.get(lookahead[0])
+                    if code is None:
+                        break
+                    #@ ENDIF
+                #@ IF compact_tables
+                action = action_tab[state][code]
+                #@ ELSE
+                action = action_tab.get((state,lookahead[0]), 0)
+                #@ ENDIF
+            if action > 0:
+                stack.append(state)
+                state = action
+                read_next = True
+            elif action < 0:
+                #@ IF compact_tables
+                X,n,X_code = rules[-action-1]
+                #@ ELSE
+                X,n = rules[-action-1]
+                #@ ENDIF
+                if n > 0:
+                    state = stack[-n]
+                    del stack[-n:]
+                #@ IF unit_relabel
+                elif n < 0:
+                    state = stack.pop()
+                #@ ENDIF
+                stack.append(state)
+                #@ IF compact_tables
+                state = goto[state][X_code]
+                #@ ELSE
+                state = goto[(state,X)]
+                #@ ENDIF
+            else:
+                break
+        else:
+            return
+        expect = list(self._expected[state])
+        #@ IF error_stacks
+        errors = [ (lookahead, expect, []) ]
+        #@ ELSE
+        errors = [ (lookahead, expect) ]
+        #@ ENDIF
+        raise self.ParseErrors(errors, None)
+
+    def accepts(self, tokens):
+        """Return True if `tokens` is a valid input for the parser.
+
+        This is a shortcut for `validate`, returning False instead of
+        raising ParseErrors.
+        """
+        try:
+            self.validate(tokens)
+        except self.ParseErrors:
+            return False
+        return True
+
+    def parse_many(self, inputs, processes=None, flat=False):
+        """Parse several inputs, using a pool of worker processes.
+
+        `inputs` is an iterable over token sequences, each of the same
+        form as for `parse`.  The inputs are distributed over
+        `processes` worker processes (by default one per CPU).  The
+        parser is copied to every worker once, and the parse tables
+        are shared by all inputs handled by this worker.  If `flat`
+        is true, the inputs are parsed using `parse_flat` instead of
+        `parse`, which makes the results much cheaper to send back.
+
+        The function returns a list with one entry per input, in the
+        order of `inputs`: either the parse tree or, if the input is
+        invalid, the ParseErrors exception for this input.  Semantic
+        actions and the `nodes` function are applied in the workers,
+        so their results must be picklable.  A parser with actions or
+        `nodes` can only be copied to the workers with the "fork"
+        start method of `multiprocessing`; otherwise ValueError is
+        raised.
+        """
+        import multiprocessing
+        import os
+
+        inputs = [ list(tokens) for tokens in inputs ]
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = max(1, min(processes, len(inputs)))
+        if processes == 1:
+            res = []
+            for tokens in inputs:
+                try:
+                    if flat:
+                        res.append(self.parse_flat(tokens))
+                    else:
+                        res.append(self.parse(tokens))
+                except self.ParseErrors as e:
+                    res.append(e)
+            return res
+        if self._hooks and multiprocessing.get_start_method() != "fork":
+            msg = "actions and nodes require the 'fork' start method"
+            raise ValueError(msg)
+        chunksize = max(1, len(inputs) // (4*processes))
+        with multiprocessing.Pool(processes, self._init_worker,
+                                  (self, flat)) as pool:
+            res = pool.map(self._parse_item, inputs, chunksize)
+
+        # The end-of-input markers in the error messages are copies
+        # made by the workers.  Replace them by `self.EOF`.
+        EOF = self.EOF
+        for e in res:
+            if not isinstance(e, self.ParseErrors):
+                continue
+            errors = []
+            for err in e.errors:
+                token = err[0]
+                if type(token[0]) is type(EOF):
+                    token = (EOF,) + token[1:]
+                expect = [ EOF if type(X) is type(EOF) else X
+                           for X in err[1] ]
+                errors.append((token, expect) + err[2:])
+            e.errors = errors
+        return res
+
+    @classmethod
+    def _init_worker(cls, parser, flat):
+        """Internal function to set up a worker process for `parse_many`."""
+        if flat:
+            cls._worker = parser.parse_flat
+        else:
+            cls._worker = parser.parse
+
+    @classmethod
+    def _parse_item(cls, tokens):
+        """Internal function to parse one input in a worker process."""
+        try:
+            return cls._worker(tokens)
+        except cls.ParseErrors as e:
+            return e
+
+    def reset(self):
+        """Discard all input passed to `feed` since the last call to
+        `finish`.
+        """
+        self._stack = []
+        self._state = 0
+        self._errors = []
+        self._error = None
+        self._pending = []
+        self._panicking = False
+
+    def _feed(self, tokens, final=False):
+        """Internal function to parse the tokens passed to `feed`.
+
+        Parsing stops when 'tokens' is exhausted.  After a parse
+        error, the following tokens are collected in `self._pending`
+        until enough input for the error recovery is available, or
+        until 'final' indicates that no more input will follow.
+        """
+        stack = self._stack
+        state = self._state
+        tokens = self._Input(tokens)
+        while True:
+            if self._panicking:
+                token = next(tokens.it, None)
+                if token is None:
+                    break
+                try:
+                    res = self._panic(self._errors, stack, state, token,
+                                      tokens)
+                except self.ParseErrors:
+                    self.reset()
+                    raise
+                if res is None:
+                    break
+                self._panicking = False
+                stack,state = res
+            lookahead = self._error
+            if lookahead is not None:
+                pending = self._pending
+                while len(pending) < self.n:
+                    token = next(tokens.it, None)
+                    if token is None:
+                        break
+                    pending.append(token)
+                if len(pending) < self.n and not final:
+                    break
+                self._error = None
+                self._pending = []
+                tokens.push(pending)
+                try:
+                    res = self._recover(self._errors, stack, state,
+                                        lookahead, tokens, self.m)
+                except self.ParseErrors:
+                    self.reset()
+                    raise
+                if res is None:
+                    # panic mode needs more input
+                    self._panicking = True
+                    break
+                stack,state = res
+            _,_,state,lookahead = self._parse(tokens.it, stack, state,
+                                              self._hooks)
+            if lookahead is None:
+                break
+            self._error = lookahead
+        self._stack = stack
+        self._state = state
+
+    def feed(self, *tokens):
+        """Pass one or more input tokens to the incremental parser.
+
+        The tokens have the same form as for `parse`.  Parsing
+        proceeds as far as possible with the tokens passed so far,
+        and the parser stack is kept between calls, so that long
+        inputs can be processed piece by piece as they arrive.
+        Use `finish` to obtain the parse tree once all input has been
+        passed to the parser.
+
+        ParseErrors is raised (and the input passed so far is
+        discarded) if `max_err` errors have been found or if the
+        input cannot be repaired.  Other parse errors are reported by
+        `finish`.
+        """
+        self._feed(iter(tokens))
+
+    def finish(self):
+        """Complete the incremental parse and return the parse tree.
+
+        This marks the end of the input passed to `feed`.  If the
+        input is invalid, a ParseErrors exception is raised, otherwise
+        the parse tree is returned.  Afterwards the parser is ready to
+        accept a new input.
+        """
+        try:
+            self._feed(iter([(self.EOF,)]), True)
+            tree = self._stack[0][1]
+            errors = self._errors
+        finally:
+            self.reset()
         if errors:
             raise self.ParseErrors(errors, tree)
         return tree
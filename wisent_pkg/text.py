@@ -64,7 +64,7 @@ def write_block(fd, indent, str, params={}, first=False):
     If `first` is False, a leading empty line is added.
 
     Blocks between lines of the form '#@ IF cond' and '#@ ENDIF' are
-    removed if 'params[cond]' is not True.
+    removed if 'params[cond]' is not True.  Such blocks can be nested.
     """
     lines = [l.rstrip().expandtabs() for l in str.splitlines()]
     while lines and not lines[0]:
@@ -84,9 +84,9 @@ def write_block(fd, indent, str, params={}, first=False):
         if l0.startswith('#@'):
             token = l0[2:].split()
             if token[0] == "IF":
-                stack.append(params.get(token[1], False))
+                stack.append(stack[-1] and bool(params.get(token[1], False)))
             elif token[0] == "ELSE":
-                stack[-1] = not stack[-1]
+                stack[-1] = stack[-2] and not stack[-1]
             elif token[0] == "ENDIF":
                 stack.pop()
             continue
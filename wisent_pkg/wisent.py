@@ -23,7 +23,7 @@ import sys
 from os.path import basename
 from optparse import OptionParser
 
-from .grammar import read_grammar
+from .grammar import read_grammar, Conflicts
 from .automaton import Automaton
 from .helpers import open_executable
 from .version import VERSION
@@ -35,6 +35,22 @@ def main():
 
     getopt = OptionParser("usage: %prog [options] grammar")
     getopt.remove_option("-h")
+    getopt.add_option("-a", "--api", action="append", type="choice",
+                      choices=["iter", "flat", "events", "validate", "many",
+                               "all"],
+                      dest="api", default=[],
+                      help="emit the optional parser methods for NAME "
+                      "(iter, flat, events, validate, many or all)",
+                      metavar="NAME")
+    getopt.add_option("-c", "--compact", action="store_true",
+                      dest="compact_flag",
+                      help="emit integer-coded parse tables")
+    getopt.add_option("-C", "--compare", action="store_true",
+                      dest="compare_flag",
+                      help="report whether LALR(1) and LR(1) tables differ")
+    getopt.add_option("-D", "--direct", action="store_true",
+                      dest="direct_flag",
+                      help="emit one function per parser state (implies -c)")
     getopt.add_option("-d", "--debug", action="store", type="string",
                       dest="debug", default="",
                       help="enable debugging (p=parser)",
@@ -44,11 +60,22 @@ def main():
                       metavar="NAME")
     getopt.add_option("-h", "--help", action="store_true", dest="help_flag",
                       help="show this message")
+    getopt.add_option("-L", "--lalr", action="store_true", dest="lalr_flag",
+                      help="construct LALR(1) instead of LR(1) tables")
     getopt.add_option("-o", "--output", action="store", dest="output_fname",
                       help="set the output file name (default is stdout)",
                       metavar="NAME")
     getopt.add_option("-r", "--replace", action="store_true", dest="replace_flag",
                       help="replace nonterminals by numbers")
+    getopt.add_option("-s", "--sync", action="append", type="string",
+                      dest="sync_terminals", default=[],
+                      help="use TERMINAL for panic-mode error recovery",
+                      metavar="TERMINAL")
+    getopt.add_option("-u", "--unit-rules", action="store", type="choice",
+                      choices=["keep", "transparent", "skip"],
+                      dest="unit_rules", default="keep",
+                      help="treatment of unit rules (keep, transparent, skip)",
+                      metavar="MODE")
     getopt.add_option("-V","--version",action="store_true",dest="version_flag",
                       help="show version information")
     (options,args)=getopt.parse_args()
@@ -88,6 +115,13 @@ information about these matters, see the file named COPYING."""%VERSION)
         params["parser_comment"] = True
         params["parser_debugprint"] = True
     params["replace_nonterminals"] = options.replace_flag
+    params["compact_tables"] = options.compact_flag
+    params["direct_code"] = options.direct_flag
+    params["unit_rules"] = options.unit_rules
+    params["sync_terminals"] = options.sync_terminals
+    params["lalr"] = options.lalr_flag
+    for name in ["iter", "flat", "events", "validate", "many"]:
+        params["api_"+name] = name in options.api or "all" in options.api
 
     ######################################################################
     # read the grammar
@@ -105,8 +139,34 @@ information about these matters, see the file named COPYING."""%VERSION)
             print(msg, file=sys.stderr)
             raise SystemExit(1)
 
+    def compare(a, b):
+        # `a` and `b` are the LR(1) and LALR(1) automata for a grammar
+        try:
+            a.check()
+        except Conflicts:
+            # the conflicts are reported by the caller
+            return
+        try:
+            same = b.same_tables(a)
+        except Conflicts:
+            msg = "the grammar is LR(1), but not LALR(1)"
+        else:
+            if same:
+                msg = "the LALR(1) and LR(1) tables are the same"
+            else:
+                msg = "the LALR(1) tables differ from the LR(1) tables"
+                msg += " (%d instead of %d states)"%(len(b.states),
+                                                     len(a.states))
+        print("%s: %s"%(progname, msg), file=sys.stderr)
+
     def check(g, params):
         a = Automaton(g, params)
+        if options.compare_flag:
+            b = Automaton(g, dict(params, lalr=not options.lalr_flag))
+            if options.lalr_flag:
+                compare(b, a)
+            else:
+                compare(a, b)
         a.check()
         return a
 
@@ -115,6 +175,9 @@ information about these matters, see the file named COPYING."""%VERSION)
         text = text.decode("utf-8")
     a = read_grammar(text.splitlines(), params, check)
     del text
+    for X in options.sync_terminals:
+        if X not in a.g.terminals:
+            getopt.error("'%s' is not a terminal symbol of the grammar"%X)
 
     ######################################################################
     # emit the parser